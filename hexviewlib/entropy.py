@@ -0,0 +1,183 @@
+#
+#   entropy.py
+#
+#   Copyright 2016 by Walter de Jong <walter@heiho.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+'''byte statistics of file regions, for the minimap'''
+
+import os
+import math
+import threading
+import collections
+
+
+# byte classes of a region
+ZERO = 0
+ASCII = 1
+HIGHBIT = 2
+RANDOM = 3
+BINARY = 4
+
+# regions are sampled in blocks of this size
+BLOCKSIZE = 4096
+# at most this many blocks are sampled per region
+MAX_BLOCKS = 256
+
+PRINTABLE = bytes(range(0x20, 0x7f)) + b'\t\n\r'
+# entropy (bits per byte) above which data looks random;
+# compressed or encrypted
+RANDOM_ENTROPY = 7.2
+
+
+def entropy(histogram, total):
+    '''Returns Shannon entropy in bits per byte'''
+
+    if not total:
+        return 0.0
+
+    bits = 0.0
+    for count in histogram.values():
+        if count:
+            p = count / total
+            bits -= p * math.log2(p)
+    return bits
+
+
+def classify(histogram, total):
+    '''Returns tuple: (byte class, entropy)'''
+
+    bits = entropy(histogram, total)
+
+    if histogram[0] >= 0.9 * total:
+        return ZERO, bits
+
+    if bits >= RANDOM_ENTROPY:
+        return RANDOM, bits
+
+    printable = sum(histogram[x] for x in PRINTABLE)
+    if printable >= 0.9 * total:
+        return ASCII, bits
+
+    highbit = sum(count for x, count in histogram.items() if x >= 0x80)
+    if highbit >= 0.5 * total:
+        return HIGHBIT, bits
+
+    return BINARY, bits
+
+
+
+class EntropyMap:
+    '''statistics of a file divided into regions
+    Computed in a background thread by sampling blocks. Every pass
+    doubles the number of samples per region, so the map is rough
+    at first and is refined over time
+    '''
+
+    def __init__(self, filename, regions):
+        '''initialize and start computing
+        Raises OSError on error
+        '''
+
+        self.filename = filename
+        self.regions = regions
+        self.filesize = os.path.getsize(filename)
+        self.regionsize = max(1, -(-self.filesize // regions))
+
+        self.histograms = [collections.Counter() for _ in range(regions)]
+        self.totals = [0] * regions
+        # list of tuples: (byte class, entropy), or None if not known yet
+        self.stats = [None] * regions
+        # changes whenever the stats change
+        self.generation = 0
+
+        self.stopped = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        '''thread main function'''
+
+        try:
+            with open(self.filename, 'rb') as f:
+                npass = 0
+                while not self.stopped and self.sample_pass(f, npass):
+                    npass += 1
+        except OSError:
+            pass
+        finally:
+            self.done.set()
+
+    def sample_pass(self, f, npass):
+        '''sample every region once more
+        Pass 0 samples the start of each region; pass n > 0 samples
+        the points halfway in between the points of earlier passes
+        Returns False when there is nothing left to sample
+        '''
+
+        if npass == 0:
+            fractions = [0.0]
+        else:
+            parts = 1 << npass
+            fractions = [(2 * j + 1) / parts for j in range(parts >> 1)]
+
+        for region in range(self.regions):
+            base = region * self.regionsize
+            end = min(base + self.regionsize, self.filesize)
+            for fraction in fractions:
+                if self.stopped:
+                    return False
+
+                offset = base + int(fraction * self.regionsize)
+                if offset >= end:
+                    continue
+                f.seek(offset)
+                data = f.read(min(BLOCKSIZE, end - offset))
+                self.histograms[region].update(data)
+                self.totals[region] += len(data)
+
+            if self.totals[region]:
+                self.stats[region] = classify(self.histograms[region],
+                                              self.totals[region])
+                self.generation += 1
+
+        # stop when the samples cover the regions
+        blocks = 1 << npass
+        return blocks * BLOCKSIZE < self.regionsize and blocks < MAX_BLOCKS
+
+    def busy(self):
+        '''Returns True while still computing'''
+
+        return not self.done.is_set()
+
+    def region(self, offset):
+        '''Returns region number for file offset'''
+
+        return offset // self.regionsize
+
+    def cancel(self):
+        '''stop computing'''
+
+        self.stopped = True
+        self.done.wait()
+
+# EOB
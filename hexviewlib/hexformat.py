@@ -0,0 +1,217 @@
+#
+#   hexformat.py
+#
+#   Copyright 2016 by Walter de Jong <walter@heiho.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+'''formatting of hex view rows
+Rows are formatted with a few calls into C rather than
+one call per byte: bytes.hex() does the hex digits and grouping,
+and bytes.translate() does the printable characters
+'''
+
+import re
+import time
+
+
+# layout per word size: (separator between words,
+# separator between groups of 8 bytes, trailing space)
+LAYOUTS = {1: (' ', '  ', 1),
+           2: ('  ', '   ', 0),
+           4: ('    ', '     ', 0)}
+
+# bytes per group
+GROUPSIZE = 8
+
+# per encoding: (translate table, invisibles table)
+TABLES = {}
+
+# runs of invisibles in a translated row
+REGEX_INVISIBLE = re.compile(b'\x01+')
+
+
+def row_width(linesize, wordsize=1):
+    '''Returns width of formatted hex bytes for full row'''
+
+    wordsep, groupsep, trailing = LAYOUTS[wordsize]
+    words = linesize // wordsize
+    groups = linesize // GROUPSIZE
+    return (linesize * 2 + (words - 1) * len(wordsep) +
+            (groups - 1) * (len(groupsep) - len(wordsep)) + trailing)
+
+
+def hex_row(row, linesize, wordsize=1):
+    '''Returns hex bytes of row, in words of wordsize bytes
+    A short row is padded with spaces to the full width
+    '''
+
+    wordsep, groupsep, _ = LAYOUTS[wordsize]
+    groups = []
+    for i in range(0, len(row), GROUPSIZE):
+        # negative: separators are counted from the left
+        group = row[i:i + GROUPSIZE].hex(' ', -wordsize)
+        if wordsep != ' ':
+            group = group.replace(' ', wordsep)
+        groups.append(group)
+
+    return groupsep.join(groups).upper().ljust(row_width(linesize, wordsize))
+
+
+def tables(encoding):
+    '''Returns tuple: (translate table, invisibles table) for encoding
+    The translate table turns unprintable bytes into dots,
+    the invisibles table turns them into 1 and the rest into 0
+    '''
+
+    if encoding not in TABLES:
+        dot = '.'.encode(encoding)[0]
+        translate = bytearray(256)
+        invisibles = bytearray(256)
+        for i in range(256):
+            if bytes([i]).decode(encoding).isprintable():
+                translate[i] = i
+            else:
+                translate[i] = dot
+                invisibles[i] = 1
+        TABLES[encoding] = (bytes(translate), bytes(invisibles))
+
+    return TABLES[encoding]
+
+
+def ascii_row(row, encoding):
+    '''Returns tuple: (text, invisibles) for row
+    invisibles is a tuple of runs (offset, length) of unprintable bytes
+    '''
+
+    translate, invisibles = tables(encoding)
+    row = bytes(row)
+    text = row.translate(translate).decode(encoding)
+
+    mask = row.translate(invisibles)
+    if 1 not in mask:
+        return text, ()
+
+    runs = tuple((m.start(), m.end() - m.start())
+                 for m in REGEX_INVISIBLE.finditer(mask))
+    return text, runs
+
+
+def format_page(page, linesize, wordsize, encoding):
+    '''Returns list of tuples: (hex bytes, text, invisibles)
+    for every row in page
+    '''
+
+    rows = []
+    for offset in range(0, len(page), linesize):
+        row = page[offset:offset + linesize]
+        text, invisibles = ascii_row(row, encoding)
+        rows.append((hex_row(row, linesize, wordsize), text, invisibles))
+    return rows
+
+
+def benchmark():
+    '''compare against formatting byte by byte'''
+
+    def old_hex_row(row, linesize, wordsize=1):
+        '''format hex bytes one by one'''
+
+        line = ''
+        for i in range(0, linesize):
+            if wordsize == 1:
+                if i % 8 == 0 and i > 0:
+                    line += ' '
+                if i < len(row):
+                    line += '{:02X} '.format(row[i])
+                else:
+                    line += '   '
+                continue
+
+            if i % wordsize == 0 and i > 0:
+                line += LAYOUTS[wordsize][0]
+            if i % 8 == 0 and i > 0:
+                line += ' '
+            if i < len(row):
+                line += '{:02X}'.format(row[i])
+            else:
+                line += '  '
+        return line
+
+    def old_ascii_row(row, encoding):
+        '''format printable bytes one by one'''
+
+        invis = []
+        line = ''
+        for i, ch in enumerate(row):
+            s = bytes([ch]).decode(encoding)
+            if s.isprintable():
+                ch = s
+            else:
+                ch = '.'
+                invis.append(i)
+            line += ch
+        return line, invis
+
+    def old_format_page(page, linesize, wordsize, encoding):
+        '''format page byte by byte'''
+
+        rows = []
+        for offset in range(0, len(page), linesize):
+            row = page[offset:offset + linesize]
+            text, invis = old_ascii_row(row, encoding)
+            rows.append((old_hex_row(row, linesize, wordsize), text, invis))
+        return rows
+
+    page = bytes(range(256)) * 4 + b'hexview'
+    linesize = 32
+    for wordsize in sorted(LAYOUTS):
+        for encoding in ('latin-1', 'cp500', 'cp437'):
+            for offset in range(0, len(page), linesize):
+                row = page[offset:offset + linesize]
+                assert hex_row(row, linesize, wordsize) == old_hex_row(row, linesize, wordsize)
+                text, runs = ascii_row(row, encoding)
+                old_text, invis = old_ascii_row(row, encoding)
+                assert text == old_text
+                assert [i for start, n in runs for i in range(start, start + n)] == invis
+
+    number = 200
+    rows = len(page) // linesize + 1
+    print('formatting {} rows of {} bytes, {} times'.format(rows, linesize,
+                                                           number))
+    for wordsize in sorted(LAYOUTS):
+        start = time.perf_counter()
+        for _ in range(number):
+            old_format_page(page, linesize, wordsize, 'latin-1')
+        old = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(number):
+            format_page(page, linesize, wordsize, 'latin-1')
+        new = time.perf_counter() - start
+
+        print('{:2d}-bit words: {:8.2f} ms  {:8.2f} ms  {:5.1f}x faster'.format(
+            wordsize * 8, old * 1000, new * 1000, old / new))
+
+
+
+if __name__ == '__main__':
+    benchmark()
+
+# EOB
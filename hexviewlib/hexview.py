@@ -25,12 +25,23 @@
 '''hex file viewer'''
 
 import os
+import re
 import sys
+import time
+import array
+import mmap
+import threading
+import collections
+import itertools
+import stat
 import curses
 import struct
 import getopt
 
 from hexviewlib import textmode
+from hexviewlib import search
+from hexviewlib import entropy
+from hexviewlib import hexformat
 
 from hexviewlib.textmode import Rect
 from hexviewlib.textmode import WHITE, YELLOW, GREEN, CYAN, BLUE #, MAGENTA
@@ -47,26 +58,47 @@ OPT_FORCE_WINDOW_WIDTH = None
 OPT_LINEMODE = textmode.LM_HLINE | textmode.LM_VLINE
 CHAR_ENCODINGS = { name: i for i, name in enumerate(['latin-1', 'cp500', 'cp437', ]) }
 OPT_ENCODING = CHAR_ENCODINGS['latin-1']
+OPT_MMAP = False
+OPT_CACHESIZE = None
+OPT_READAHEAD = True
+# longest match for regex searches
+OPT_REGEX_MAXLEN = 256
+OPT_JOBS = 1
+OPT_SEARCH_CACHE = None
 
 class MemoryFile:
-    '''access file data as if it is an in-memory array'''
+    '''access file data as if it is an in-memory array
+    File data is cached in fixed-size, aligned blocks.
+    The least recently used blocks are evicted first
+    '''
 
-    IOSIZE = 256 * 1024
+    BLOCKSIZE = 64 * 1024
+    # default memory budget for the block cache
+    CACHESIZE = 16 * 1024 * 1024
+    # every load gets a new generation number
+    GENERATIONS = itertools.count(1)
 
-    def __init__(self, filename=None, pagesize=25*16):
+    def __init__(self, filename=None, pagesize=25*16, cachesize=None):
         '''initialise'''
 
         self.filename = filename
         self.filesize = 0
         self.fd = None
-        self.low = self.high = 0
         self.pagesize = pagesize
-        self.cachesize = self.pagesize * 3
-        # round up to nearest multiple of
-        if self.cachesize % MemoryFile.IOSIZE != 0:
-            self.cachesize += (MemoryFile.IOSIZE -
-                               (self.cachesize % MemoryFile.IOSIZE))
-        self.data = None
+        if cachesize is None:
+            cachesize = MemoryFile.CACHESIZE
+        self.cachesize = cachesize
+        # always keep enough blocks to cover a screen page
+        self.maxblocks = max(cachesize // MemoryFile.BLOCKSIZE,
+                             pagesize // MemoryFile.BLOCKSIZE + 2)
+        self.blocks = collections.OrderedDict()
+        # the cache is shared with the read-ahead thread
+        self.lock = threading.Lock()
+        self.prefetcher = None
+        # cache statistics
+        self.hits = self.misses = 0
+        # changes whenever the file data may have changed
+        self.generation = 0
 
         if filename is not None:
             self.load(filename)
@@ -77,20 +109,24 @@ class MemoryFile:
         self.filename = filename
         self.filesize = os.path.getsize(self.filename)
         self.fd = open(filename, 'rb')
-        self.data = bytearray(self.fd.read(self.cachesize))
-        self.low = 0
-        self.high = len(self.data)
+        self.blocks.clear()
+        self.hits = self.misses = 0
+        self.generation = next(MemoryFile.GENERATIONS)
 
     def close(self):
         '''close the file'''
 
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self.prefetcher = None
+
         if self.fd is not None:
             self.fd.close()
             self.fd = None
 
         self.filename = None
         self.filesize = 0
-        self.data = None
+        self.blocks.clear()
 
     def __len__(self):
         '''Returns length'''
@@ -105,68 +141,384 @@ class MemoryFile:
             if idx < 0 or idx >= self.filesize:
                 raise IndexError('MemoryFile out of bounds error')
 
+            blockno, offset = divmod(idx, MemoryFile.BLOCKSIZE)
+            return self.getblock(blockno)[offset]
+
+        if isinstance(idx, slice):
+            # return slice
+            if idx.start < 0 or idx.stop > self.filesize:
+                raise IndexError('MemoryFile out of bounds error')
+
+            return self.read(idx.start, idx.stop - idx.start)[::idx.step]
+
+        raise TypeError('invalid argument type')
+
+    def read(self, offset, length):
+        '''Returns buffer with length bytes at offset
+        The buffer is short when reading beyond end of file
+        '''
+
+        if offset < 0:
+            raise IndexError('MemoryFile out of bounds error')
+
+        if offset + length > self.filesize:
+            length = self.filesize - offset
+        if length <= 0:
+            return b''
+
+        blockno, offset = divmod(offset, MemoryFile.BLOCKSIZE)
+        block = self.getblock(blockno)
+        if offset + length <= len(block):
+            # range lies within a single block
+            return block[offset:offset + length]
+
+        # gather the range from consecutive blocks
+        parts = [block[offset:]]
+        length -= len(parts[0])
+        while length > 0:
+            blockno += 1
+            block = self.getblock(blockno)
+            if not block:
+                # the file shrank
+                break
+            parts.append(block[:length])
+            length -= len(block)
+
+        return b''.join(parts)
+
+    def getblock(self, blockno):
+        '''Returns block from the cache
+        The block is read in on a cache miss
+        '''
+
+        with self.lock:
+            block = self.blocks.get(blockno)
+            if block is not None:
+                self.hits += 1
+                self.blocks.move_to_end(blockno)
+                return block
+
+            self.misses += 1
+
+        return self.pagefault(blockno)
+
+    def pagefault(self, blockno):
+        '''page in block
+        Returns the block
+        '''
+
+        self.fd.seek(blockno * MemoryFile.BLOCKSIZE, os.SEEK_SET)
+        block = self.fd.read(MemoryFile.BLOCKSIZE)
+        self.store(blockno, block)
+        return block
+
+    def store(self, blockno, block):
+        '''put block into the cache'''
+
+        with self.lock:
+            self.blocks[blockno] = block
+            while len(self.blocks) > self.maxblocks:
+                # evict least recently used block
+                self.blocks.popitem(last=False)
+
+    def cached(self, blockno):
+        '''Returns True if block is in the cache'''
+
+        with self.lock:
+            return blockno in self.blocks
+
+    def readahead(self, addr, length, direction):
+        '''hint that the range at addr will be needed soon
+        The blocks are read in the background, in the given direction
+        '''
+
+        if self.fd is None or not OPT_READAHEAD:
+            return
+
+        if addr < 0:
+            length += addr
+            addr = 0
+        if addr + length > self.filesize:
+            length = self.filesize - addr
+        # do not let read-ahead push out the blocks on screen
+        if length > self.cachesize // 2:
+            length = self.cachesize // 2
+        if length <= 0:
+            return
+
+        if self.prefetcher is None:
+            try:
+                self.prefetcher = ReadAhead(self)
+            except OSError:
+                # can not open a second handle; no read-ahead then
+                self.prefetcher = False
+
+        if self.prefetcher:
+            self.prefetcher.request(addr // MemoryFile.BLOCKSIZE,
+                                    (addr + length - 1) // MemoryFile.BLOCKSIZE,
+                                    direction)
+
+
+
+class ReadAhead:
+    '''background thread that reads blocks into a MemoryFile cache
+    Only the most recent request is served; a new request
+    supersedes the one that is in progress
+    '''
+
+    def __init__(self, memfile):
+        '''initialize
+        Raises OSError if the file can not be opened
+        '''
+
+        self.memfile = memfile
+        # use a separate handle; the main thread keeps its file position
+        self.fd = open(memfile.filename, 'rb')
+        self.cond = threading.Condition()
+        self.pending = None
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, first, last, direction):
+        '''request blocks first up to and including last'''
+
+        with self.cond:
+            self.pending = (first, last, direction)
+            self.cond.notify()
+
+    def stop(self):
+        '''stop the thread'''
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def run(self):
+        '''thread main loop'''
+
+        blocksize = MemoryFile.BLOCKSIZE
+        while True:
+            with self.cond:
+                while self.pending is None and not self.stopped:
+                    self.cond.wait()
+
+                if self.stopped:
+                    break
+
+                first, last, direction = self.pending
+                self.pending = None
+
+            if direction < 0:
+                blocknos = range(last, first - 1, -1)
+            else:
+                blocknos = range(first, last + 1)
+
+            for blockno in blocknos:
+                if self.pending is not None or self.stopped:
+                    # superseded by a newer request
+                    break
+
+                if self.memfile.cached(blockno):
+                    continue
+
+                try:
+                    self.fd.seek(blockno * blocksize, os.SEEK_SET)
+                    block = self.fd.read(blocksize)
+                except (OSError, ValueError):
+                    break
+
+                if not block:
+                    break
+
+                self.memfile.store(blockno, block)
+
+        self.fd.close()
+
+
+
+class MmapMemoryFile(MemoryFile):
+    '''access file data through sliding mmap windows
+    Slices are returned as zero-copy memoryviews into the mapping.
+    Only a window of the file is mapped at any time, so this works
+    for files that are larger than the address space
+    '''
+
+    WINDOWSIZE = 64 * 1024 * 1024
+
+    def load(self, filename):
+        '''open file
+        Raises OSError, ValueError if the file can not be mapped
+        '''
+
+        self.filename = filename
+        self.fd = open(filename, 'rb')
+        self.filesize = os.fstat(self.fd.fileno()).st_size
+        self.low = self.high = 0
+        self.mapping = None
+        self.data = None
+        self.generation = next(MemoryFile.GENERATIONS)
+        try:
+            self.pagefault(0)
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        '''close the file'''
+
+        # do not close the mapping explicitly; memoryviews handed out
+        # may still reference it. It is unmapped when the last one goes
+        self.mapping = None
+        self.data = None
+        super().close()
+
+    def __getitem__(self, idx):
+        '''Return byte or memoryview of range at idx'''
+
+        if isinstance(idx, int):
+            if idx < 0 or idx >= self.filesize:
+                raise IndexError('MemoryFile out of bounds error')
+
             if idx < self.low or idx >= self.high:
+                self.misses += 1
                 self.pagefault(idx)
+            else:
+                self.hits += 1
 
             return self.data[idx - self.low]
 
         if isinstance(idx, slice):
-            # return slice
             if idx.start < 0 or idx.stop > self.filesize:
                 raise IndexError('MemoryFile out of bounds error')
 
-            if idx.start < self.low or idx.stop > self.high:
-                self.pagefault(self.low)
-
-            return self.data[idx.start - self.low:
-                             idx.stop - self.low:idx.step]
+            return self.read(idx.start, idx.stop - idx.start)[::idx.step]
 
         raise TypeError('invalid argument type')
 
-    def pagefault(self, addr):
-        '''page in data as needed'''
+    def read(self, offset, length):
+        '''Returns memoryview of length bytes at offset
+        The buffer is short when reading beyond end of file
+        '''
 
-        self.low = addr - self.cachesize // 2
-        if self.low < 0:
-            self.low = 0
+        if offset < 0:
+            raise IndexError('MemoryFile out of bounds error')
 
-        self.high = addr + self.cachesize // 2
-        if self.high > self.filesize:
-            self.high = self.filesize
+        if offset + length > self.filesize:
+            length = self.filesize - offset
+        if length <= 0:
+            return memoryview(b'')
 
-        self.fd.seek(self.low, os.SEEK_SET)
-        size = self.high - self.low
-        self.data = bytearray(self.fd.read(size))
-        self.high = self.low + len(self.data)
+        if offset < self.low or offset + length > self.high:
+            self.misses += 1
+            self.pagefault(offset, length)
+        else:
+            self.hits += 1
 
-    def find(self, searchtext, pos):
-        '''find searchtext
-        Returns -1 if not found
+        return self.data[offset - self.low:offset + length - self.low]
+
+    def pagefault(self, addr, length=1):
+        '''map a window that holds addr up to addr + length'''
+
+        low = addr - MmapMemoryFile.WINDOWSIZE // 4
+        # mmap offsets must be aligned
+        low -= low % mmap.ALLOCATIONGRANULARITY
+        if low < 0:
+            low = 0
+
+        high = addr + length + MmapMemoryFile.WINDOWSIZE * 3 // 4
+        if high > self.filesize:
+            high = self.filesize
+
+        mapping = mmap.mmap(self.fd.fileno(), high - low,
+                            access=mmap.ACCESS_READ, offset=low)
+        self.mapping = mapping
+        self.data = memoryview(mapping)
+        self.low = low
+        self.high = high
+
+    def readahead(self, addr, length, direction):
+        '''hint that the range at addr will be needed soon
+        The kernel pages it in asynchronously
         '''
 
-        if isinstance(searchtext, str):
-            searchtext = bytes(searchtext, 'utf-8')
+        if (not OPT_READAHEAD or self.mapping is None or
+                not hasattr(mmap, 'MADV_WILLNEED')):
+            return
 
-        if pos < 0 or pos >= self.filesize:
-            return -1
+        low = max(addr, self.low)
+        high = min(addr + length, self.high)
+        if low >= high:
+            return
 
-        if pos < self.low or pos + len(searchtext) >= self.high:
-            self.pagefault(self.low)
+        offset = low - self.low
+        offset -= offset % mmap.PAGESIZE
+        self.mapping.madvise(mmap.MADV_WILLNEED, offset,
+                             high - self.low - offset)
 
-        pos -= self.low
 
-        while True:
-            idx = self.data.find(searchtext, pos)
-            if idx >= 0:
-                # found
-                return idx + self.low
+def open_memoryfile(filename, pagesize, cachesize=None):
+    '''Returns MemoryFile for filename
+    Uses mmap when enabled, but falls back to plain reads for pipes,
+    special files and files that can not be mapped
+    Raises OSError on error
+    '''
 
-            if self.high >= self.filesize:
-                # not found
-                return -1
+    if OPT_MMAP and stat.S_ISREG(os.stat(filename).st_mode):
+        try:
+            return MmapMemoryFile(filename, pagesize)
+        except (OSError, ValueError):
+            pass
 
-            self.low = self.high - len(searchtext)
-            self.pagefault(self.low)
+    return MemoryFile(filename, pagesize, cachesize)
+
+
+
+class RowCache:
+    '''LRU cache of formatted rows
+    A key holds the row offset, the display settings and the
+    generation of the file data; after a reload the old rows
+    simply stop being looked up and age out of the LRU
+    '''
+
+    MAXENTRIES = 1024
+
+    def __init__(self, maxentries=None):
+        '''initialize'''
+
+        if maxentries is None:
+            maxentries = RowCache.MAXENTRIES
+        self.maxentries = maxentries
+        self.entries = collections.OrderedDict()
+        # cache statistics
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        '''Returns cached row, or None if not cached'''
+
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''store row in cache'''
+
+        self.entries[key] = value
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        '''empty the cache'''
+
+        self.entries.clear()
+        self.hits = self.misses = 0
 
 
 
@@ -176,6 +528,7 @@ class HexWindow(textmode.Window):
     MODE_8BIT = 1
     MODE_16BIT = 2
     MODE_32BIT = 4
+    VIEWMODE = 7
     CLEAR_VIEWMODE = 0xffff & ~7
     MODE_SELECT = 8
     MODE_VALUES = 0x10
@@ -184,6 +537,18 @@ class HexWindow(textmode.Window):
     FORWARD = 0
     BACKWARD = 1
 
+    # minimum number of pages to read ahead while scrolling
+    READAHEAD_PAGES = 4
+
+    # searches that take longer than this show progress (in seconds)
+    PROGRESS_DELAY = 0.2
+    # seconds to wait for a match while typing
+    INCSEARCH_DELAY = 0.02
+    # default minimum length for :strings
+    STRINGS_MINLEN = 4
+    # widest minimap; it only uses spare width
+    MINIMAP_WIDTH = 16
+
     def __init__(self, x, y, w, h, colors, title=None, border=True, print_values=False):
         '''initialize'''
         full_h = h
@@ -196,25 +561,59 @@ class HexWindow(textmode.Window):
                 return 80, 16
             else:
                 return 80+data_width, 32
+        available = w
         w, line_width = get_window_and_line_width(w)            
         # turn off window shadow for HexWindow
         # because it clobbers the bottom statusbar
         super().__init__(x, y, w, h, colors, title, border, shadow=False)
         self.data = None
+        self.scanner = None
         self.address = 0
         self.linesize = line_width
         self.cursor_x = self.cursor_y = 0
         self.mode = HexWindow.MODE_8BIT | (HexWindow.MODE_VALUES if print_values else 0)
         self.selection_start = self.selection_end = 0
         self.old_addr = self.old_x = self.old_y = 0
+        # scroll direction and velocity drive read-ahead
+        self.scroll_addr = 0
+        self.scroll_time = 0.0
+        self.scroll_speed = 0.0
 
         colors = textmode.ColorSet(WHITE, BLACK)
         colors.cursor = textmode.video_color(WHITE, GREEN, bold=True)
         self.cmdline = CommandBar(colors, prompt=':')
         self.search = CommandBar(colors, prompt='/')
         self.searchdir = HexWindow.FORWARD
+        # current search and its index of all matches
+        self.matcher = None
+        self.search_key = None
+        self.matchindex = None
+        self.status_len = 0
+        # highlight all matches on screen
+        self.hlsearch = True
+        # text search options
+        self.ignorecase = False
+        self.text_encoding = 'utf-8'
+        # cache of search results; file_id identifies the file
+        self.results = search.ResultCache(OPT_SEARCH_CACHE)
+        self.results.load()
+        self.file_id = None
+        # strings scan; runs on in the background
+        self.strings = None
+        self.strings_job = None
+        # incremental search state
+        self.incsearch = True
+        self.inc_origin = None
+        self.inc_job = None
+        self.inc_key = None
+        self.inc_matcher = None
+        self.inc_result = None
+        self.inc_start = self.inc_resume = 0
+        self.highlights = []
         self.hexsearch = CommandBar(colors, prompt='x/',
-                                    inputfilter=hex_inputfilter)
+                                    inputfilter=hexpattern_inputfilter)
+        self.regexsearch = CommandBar(colors, prompt='re/')
+        self.valuesearch = CommandBar(colors, prompt='value/')
         self.jumpaddr = CommandBar(colors, prompt='@',
                                    inputfilter=hex_inputfilter)
         self.addaddr = CommandBar(colors, prompt='@+',
@@ -231,8 +630,17 @@ class HexWindow(textmode.Window):
         self.valueview = ValueSubWindow(x, y + full_h - 7, w, 7,
                                         colors)
 
+        # the minimap goes in the spare width next to the view
+        spare = min(available - w, HexWindow.MINIMAP_WIDTH)
+        if spare >= MiniMap.MIN_WIDTH:
+            self.minimap = MiniMap(x + w, y, spare, full_h, colors)
+        else:
+            self.minimap = None
+
         self.address_fmt = '{:08X}  '
         self.update_field_offset(10, 0)
+        # formatted rows that were on screen recently
+        self.rows = RowCache()
 
     def update_field_offset(self, byte_offset, extra=0):
         self.bytes_offset = byte_offset
@@ -270,16 +678,38 @@ class HexWindow(textmode.Window):
         self.cmdline.resize_event()
         self.search.resize_event()
         self.hexsearch.resize_event()
+        self.regexsearch.resize_event()
+        self.valuesearch.resize_event()
         self.jumpaddr.resize_event()
         self.addaddr.resize_event()
         self.valueview.resize_event()
+        if self.minimap is not None:
+            self.minimap.resize_event()
 
     def load(self, filename):
         '''load file
         Raises OSError on error
         '''
 
-        self.data = MemoryFile(filename, self.bounds.h * self.linesize)
+        data = open_memoryfile(filename, self.bounds.h * self.linesize,
+                               OPT_CACHESIZE)
+        # stops the read-ahead thread of the previous file
+        if self.data is not None:
+            self.data.close()
+        self.data = data
+        if self.scanner is not None:
+            self.scanner.close()
+        if self.strings_job is not None:
+            self.strings_job.cancel()
+        self.strings = self.strings_job = None
+        if OPT_JOBS > 1:
+            self.scanner = search.ParallelScanner(filename, OPT_JOBS)
+        else:
+            self.scanner = search.Scanner(filename)
+        self.file_id = None
+        self.matchindex = None
+        if self.minimap is not None:
+            self.minimap.load(filename)
 
         self.title = os.path.basename(filename)
         if len(self.title) > self.bounds.w:
@@ -317,15 +747,32 @@ class HexWindow(textmode.Window):
         if self.mode & HexWindow.MODE_VALUES:
             self.valueview.show()
 
+        if self.minimap is not None:
+            self.minimap.show()
+
         super().show()
 
     def close(self):
         '''close window'''
 
+        if self.strings_job is not None:
+            self.strings_job.cancel()
+        if self.minimap is not None:
+            self.minimap.stop()
         self.data.close()
+        self.scanner.close()
+        self.save_results()
 
         super().close()
 
+    def save_results(self):
+        '''save the search result cache, if it is kept on disk'''
+
+        try:
+            self.results.save()
+        except OSError:
+            pass
+
     def lose_focus(self):
         '''we lose focus'''
 
@@ -344,132 +791,121 @@ class HexWindow(textmode.Window):
 
         super().draw()
 
-        if self.mode & HexWindow.MODE_8BIT:
-            self.draw_view_8bit()
+        # fetch the whole page at once
+        page = self.data.read(self.address, self.bounds.h * self.linesize)
+        self.draw_lines(page, 0, self.bounds.h)
+        self.draw_page(page)
 
-        elif self.mode & HexWindow.MODE_16BIT:
-            self.draw_view_16bit()
+    def draw_lines(self, page, first, last):
+        '''draw lines first up to last of the page'''
 
-        elif self.mode & HexWindow.MODE_32BIT:
-            self.draw_view_32bit()
+        # rows are formatted once, and then taken from the cache
+        # for as long as they are on screen
+        key = (self.mode & HexWindow.VIEWMODE, self.linesize, OPT_ENCODING,
+               self.address_fmt, self.data.generation)
+        encoding = list(CHAR_ENCODINGS.keys())[OPT_ENCODING]
+        x = self.bounds.x + self.ascii_offset
+        for y in range(first, last):
+            offset = y * self.linesize
+            addr = self.address + offset
+            entry = self.rows.get((addr,) + key)
+            if entry is None:
+                row = page[offset:offset + self.linesize]
+                entry = self.format_row(addr, row, encoding)
+                self.rows.put((addr,) + key, entry)
+
+            line, text, invis = entry
+            self.puts(0, y, line, self.colors.text)
 
-        self.draw_statusbar()
+            # put the ASCII bytes line
+            self.puts(self.ascii_offset, y, text, self.colors.text)
 
-    def draw_statusbar(self):
-        '''draw statusbar'''
+            # color runs of invisibles
+            for i, n in invis:
+                textmode.VIDEO.color_hline(x + i, self.bounds.y + y, n,
+                                           self.colors.invisibles)
 
-        status = None
-        if self.mode & HexWindow.MODE_SELECT:
-            status = 'Select'
+    def format_row(self, addr, row, encoding):
+        '''Returns tuple: (line, text, invisibles) for row at addr
+        line holds the address and the hex bytes, text holds the
+        ASCII bytes and invisibles the runs of unprintable bytes
+        '''
 
-        if status is None:
-            textmode.VIDEO.hline(self.bounds.x + self.bounds.w - 12,
-                        self.bounds.y + self.bounds.h, 10, curses.ACS_HLINE,
-                        self.colors.border)
+        if self.mode & HexWindow.MODE_16BIT:
+            wordsize = 2
+        elif self.mode & HexWindow.MODE_32BIT:
+            wordsize = 4
         else:
-            textmode.VIDEO.puts(self.bounds.x + self.bounds.w - 2 - len(status),
-                       self.bounds.y + self.bounds.h, status,
-                       self.colors.status)
-
-    def draw_view_8bit(self):
-        '''draw hexview for single bytes'''
-
-        y = 0
-        while y < self.bounds.h:
-            # address
-            offset = self.address + y * self.linesize
-            line = self.address_fmt.format(offset)
-
-            for i in range(0, self.linesize):
-                if i % 8 == 0 and i > 0:
-                    line += ' '
-                try:
-                    line += '{:02X} '.format(self.data[offset + i])
-                except IndexError:
-                    line += '   '
-
-            self.puts(0, y, line, self.colors.text)
-
-            self.draw_ascii(y)
-            y += 1
+            wordsize = 1
 
-    def draw_view_16bit(self):
-        '''draw hexview for 16 bit words'''
+        line = (self.address_fmt.format(addr) +
+                hexformat.hex_row(row, self.linesize, wordsize))
+        text, invis = hexformat.ascii_row(row, encoding)
+        return line, text, invis
 
-        y = 0
-        while y < self.bounds.h:
-            # address
-            offset = self.address + y * self.linesize
-            line = self.address_fmt.format(offset)
+    def draw_page(self, page):
+        '''draw what goes with the page, besides its lines'''
 
-            for i in range(0, self.linesize):
-                if i % 2 == 0 and i > 0:
-                    line += '  '
-                if i % 8 == 0 and i > 0:
-                    line += ' '
-                try:
-                    line += '{:02X}'.format(self.data[offset + i])
-                except IndexError:
-                    line += '  '
-
-            self.puts(0, y, line, self.colors.text)
-
-            self.draw_ascii(y)
-            y += 1
-
-    def draw_view_32bit(self):
-        '''draw hexview for 32 bit words'''
-
-        y = 0
-        while y < self.bounds.h:
-            # address
-            offset = self.address + y * self.linesize
-            line = self.address_fmt.format(offset)
-
-            for i in range(0, self.linesize):
-                if i % 4 == 0 and i > 0:
-                    line += '    '
-                if i % 8 == 0 and i > 0:
-                    line += ' '
-                if i % 16 == 0 and i > 0:
-                    line += ''
-                try:
-                    line += '{:02X}'.format(self.data[offset + i])
-                except IndexError:
-                    line += '  '
+        self.draw_highlights(page)
+        if self.minimap is not None:
+            self.minimap.set_view(self.address, len(page))
+        self.draw_statusbar()
+        self.update_readahead()
 
-            self.puts(0, y, line, self.colors.text)
+    def update_readahead(self):
+        '''track scroll direction and speed; read ahead accordingly'''
 
-            self.draw_ascii(y)
-            y += 1
+        delta = self.address - self.scroll_addr
+        if not delta:
+            return
 
-    def draw_ascii(self, y):
-        '''draw ascii bytes for line y'''
+        now = time.monotonic()
+        pagesize = self.bounds.h * self.linesize
+        elapsed = now - self.scroll_time
+        if abs(delta) > HexWindow.READAHEAD_PAGES * pagesize or elapsed > 1.0:
+            # a jump or a pause; start measuring again
+            speed = 0.0
+        else:
+            speed = delta / max(elapsed, 0.001)
+            # smooth out key repeat jitter
+            speed = (self.scroll_speed + speed) * 0.5
+        self.scroll_speed = speed
+        self.scroll_addr = self.address
+        self.scroll_time = now
+
+        # read what we expect to need within the next second,
+        # but at least a couple of pages
+        amount = max(int(abs(speed)), HexWindow.READAHEAD_PAGES * pagesize)
+        if delta < 0:
+            self.data.readahead(self.address - amount, amount, -1)
+        else:
+            self.data.readahead(self.address + pagesize, amount, 1)
 
-        encoding = list(CHAR_ENCODINGS.keys())[OPT_ENCODING]
-        invis = []
-        line = ''
-        offset = self.address + y * self.linesize
-        for i in range(0, self.linesize):
-            try:
-                ch = self.data[offset + i]
-                s = bytes([ch]).decode(encoding)
-                if s.isprintable():
-                    ch = s
-                else:
-                    ch = '.'
-                    invis.append(i)
-                line += ch
-            except IndexError:
-                ch = ' '
+    def draw_statusbar(self):
+        '''draw statusbar'''
 
-        # put the ASCII bytes line
-        self.puts(self.ascii_offset, y, line, self.colors.text)
+        if not self.flags & textmode.Window.SHOWN:
+            return
 
-        # color invisibles
-        for i in invis:
-            self.color_putch(self.ascii_offset + i, y,
-                             self.colors.invisibles)
+        status = []
+        if self.matchindex is not None:
+            status.append(self.match_status())
+        if self.mode & HexWindow.MODE_SELECT:
+            status.append('Select')
+        status = '  '.join(status)
+
+        y = self.bounds.y + self.bounds.h
+        if len(status) < self.status_len:
+            # clear the previous status
+            textmode.VIDEO.hline(self.bounds.x + self.bounds.w - 2 -
+                                 self.status_len, y,
+                                 self.status_len - len(status),
+                                 curses.ACS_HLINE, self.colors.border)
+        self.status_len = len(status)
+
+        if status:
+            textmode.VIDEO.puts(self.bounds.x + self.bounds.w - 2 - len(status),
+                                y, status, self.colors.status)
 
     def draw_cursor(self, clear=False, mark=None):          # pylint: disable=arguments-differ
         '''draw cursor'''
@@ -477,8 +913,12 @@ class HexWindow(textmode.Window):
         if not self.flags & textmode.Window.FOCUS:
             clear = True
 
+        offset = self.address + self.cursor_y * self.linesize + self.cursor_x
         if clear:
-            color = self.colors.text
+            if self.highlighted(offset):
+                color = self.colors.highlight
+            else:
+                color = self.colors.text
         else:
             color = self.colors.cursor
 
@@ -488,7 +928,6 @@ class HexWindow(textmode.Window):
         if self.mode & HexWindow.MODE_SELECT:
             self.draw_selection()
 
-        offset = self.address + self.cursor_y * self.linesize + self.cursor_x
         x = self.hexview_position(offset)
         self.draw_cursor_at(self.bytes_offset + x, self.cursor_y, color,
                             clear)
@@ -499,6 +938,9 @@ class HexWindow(textmode.Window):
 
         self.update_values()
 
+        if self.matchindex is not None:
+            self.draw_statusbar()
+
     def draw_ascii_cursor(self, ch, color, clear):
         '''draw ascii cursor'''
 
@@ -514,6 +956,10 @@ class HexWindow(textmode.Window):
             if clear:
                 color = self.colors.invisibles
 
+        if clear and self.highlighted(self.address + self.cursor_y *
+                                      self.linesize + self.cursor_x):
+            color = self.colors.highlight
+
         alt = not clear
         self.color_putch(self.ascii_offset + self.cursor_x, self.cursor_y,
                          color, alt)
@@ -565,13 +1011,19 @@ class HexWindow(textmode.Window):
     def draw_selection(self):
         '''draw selection'''
 
-        start = self.selection_start
+        self.draw_range(self.selection_start, self.selection_end,
+                        self.colors.cursor)
+
+    def draw_range(self, start, end, color):
+        '''color the range start up to end in both views'''
+
         if start < self.address:
             start = self.address
         pagesize = self.bounds.h * self.linesize
-        end = self.selection_end
         if end > self.address + pagesize:
             end = self.address + pagesize
+        if end <= start:
+            return
 
         startx = (start - self.address) % self.linesize
         starty = (start - self.address) // self.linesize
@@ -583,20 +1035,20 @@ class HexWindow(textmode.Window):
             textmode.VIDEO.color_hline((self.bounds.x + self.ascii_offset +
                                         startx),
                                        self.bounds.y + starty, endx - startx,
-                                       self.colors.cursor)
+                                       color)
         else:
             textmode.VIDEO.color_hline((self.bounds.x + self.ascii_offset +
                                         startx),
                                        self.bounds.y + starty, self.linesize - startx,
-                                       self.colors.cursor)
+                                       color)
             for j in range(starty + 1, endy):
                 textmode.VIDEO.color_hline((self.bounds.x +
                                             self.ascii_offset),
                                            self.bounds.y + j, self.linesize,
-                                           self.colors.cursor)
+                                           color)
             textmode.VIDEO.color_hline(self.bounds.x + self.ascii_offset,
                                        self.bounds.y + endy, endx,
-                                       self.colors.cursor)
+                                       color)
 
         # hex view start/end position depend on viewing mode
         startx = self.hexview_position(start)
@@ -606,20 +1058,54 @@ class HexWindow(textmode.Window):
             textmode.VIDEO.color_hline((self.bounds.x + self.bytes_offset +
                                         startx),
                                        self.bounds.y + starty, endx - startx,
-                                       self.colors.cursor)
+                                       color)
         else:
             w = self.linesize * 3
             textmode.VIDEO.color_hline((self.bounds.x + self.bytes_offset +
                                         startx),
                                        self.bounds.y + starty, w - startx,
-                                       self.colors.cursor)
+                                       color)
             for j in range(starty + 1, endy):
                 textmode.VIDEO.color_hline(self.bounds.x + self.bytes_offset,
                                            self.bounds.y + j, w,
-                                           self.colors.cursor)
+                                           color)
             textmode.VIDEO.color_hline(self.bounds.x + self.bytes_offset,
                                        self.bounds.y + endy, endx,
-                                       self.colors.cursor)
+                                       color)
+
+    def draw_highlights(self, page):
+        '''highlight all matches of the current search on the page'''
+
+        self.highlights = []
+        if not self.hlsearch or self.matcher is None or not page:
+            return
+
+        # only match the page, plus enough to complete matches
+        # that run past the end of the page
+        matcher = self.matcher
+        pagesize = len(page)
+        buf = bytes(page) + bytes(self.data.read(self.address + pagesize,
+                                                 matcher.maxlen - 1))
+        # matchers only try offsets that are aligned in the file
+        idx = -self.address % matcher.align
+        while idx < pagesize:
+            idx, length = matcher.find(buf, idx, pagesize, len(buf))
+            if idx == -1:
+                break
+
+            start = self.address + idx
+            self.highlights.append((start, start + length))
+            self.draw_range(start, start + length, self.colors.highlight)
+            idx += matcher.align
+
+    def highlighted(self, offset):
+        '''Returns True if offset is in a highlighted match'''
+
+        for start, end in self.highlights:
+            if start <= offset < end:
+                return True
+
+        return False
 
     def update_values(self):
         '''update value view'''
@@ -629,16 +1115,10 @@ class HexWindow(textmode.Window):
 
         # get data at cursor
         offset = self.address + self.cursor_y * self.linesize + self.cursor_x
-        try:
-            data = self.data[offset:offset + 8]
-        except IndexError:
-            # get data, do zero padding
-            data = bytearray(8)
-            for i in range(0, 8):
-                try:
-                    data[i] = self.data[offset + i]
-                except IndexError:
-                    break
+        data = self.data.read(offset, 8)
+        if len(data) < 8:
+            # do zero padding
+            data = bytes(data) + bytes(8 - len(data))
 
         self.valueview.update(data)
 
@@ -656,11 +1136,11 @@ class HexWindow(textmode.Window):
     def scroll_up(self, nlines=1):
         '''scroll nlines up'''
 
-        self.address -= nlines * self.linesize
-        if self.address < 0:
-            self.address = 0
+        addr = self.address - nlines * self.linesize
+        if addr < 0:
+            addr = 0
 
-        self.draw()
+        self.scroll_to(addr)
 
     def scroll_down(self, nlines=1):
         '''scroll nlines down'''
@@ -674,8 +1154,42 @@ class HexWindow(textmode.Window):
             addr = 0
 
         if addr != self.address:
+            self.scroll_to(addr)
+
+    def scroll_to(self, addr):
+        '''move the view to addr
+        Lines that stay on screen are shifted rather than redrawn
+        '''
+
+        delta = addr - self.address
+        nlines = delta // self.linesize
+        if (delta % self.linesize or abs(nlines) >= self.bounds.h or
+                self.mode & HexWindow.MODE_SELECT or
+                not self.flags & textmode.Window.SHOWN):
             self.address = addr
             self.draw()
+            return
+
+        # the cursor must not move along with the lines
+        self.clear_cursor()
+        if not textmode.VIDEO.scroll(self.bounds.x, self.bounds.y,
+                                     self.bounds.w, self.bounds.h, nlines):
+            self.address = addr
+            self.draw()
+            return
+
+        self.address = addr
+        if nlines > 0:
+            first = self.bounds.h - nlines
+        else:
+            first = 0
+            nlines = -nlines
+        textmode.VIDEO.fillrect(self.bounds.x, self.bounds.y + first,
+                                self.bounds.w, nlines, self.colors.text)
+
+        page = self.data.read(self.address, self.bounds.h * self.linesize)
+        self.draw_lines(page, first, first + nlines)
+        self.draw_page(page)
 
     def move_up(self):
         '''move cursor up'''
@@ -945,52 +1459,246 @@ class HexWindow(textmode.Window):
         getch()
         self.search.hide()
 
-    def find(self, again=False):
-        '''text search'''
+    def run_search(self, func):
+        '''run search function in the background
+        Progress is shown in the command bar; Esc cancels the search
+        Returns the result of func, or None if cancelled or failed
+        Raises OSError on error
+        '''
+
+        job = search.SearchJob(self.scanner, func)
+        if not job.wait(HexWindow.PROGRESS_DELAY):
+            self.ignore_focus = True
+            self.search.show()
+            color = textmode.video_color(WHITE, BLACK)
+            while not job.wait(0):
+                self.search.cputs(0, 0, search_progress(job), color)
+                if getch(timeout=100) == KEY_ESC:
+                    job.cancel()
+                    break
+
+            self.search.hide()
+
+        if isinstance(job.error, OSError):
+            raise job.error
+
+        if job.error is not None:
+            # a bug, not a cancelled search
+            self.search_error('Search failed: {}: {}'.format(
+                type(job.error).__name__, job.error))
+            return None
+
+        if job.cancelled():
+            return None
+
+        return job.result
+
+    def read_search(self, cmdbar, again=False):
+        '''read search text from command bar
+        If again, or if the entered text is empty, use the last search
+        Returns tuple: (searchtext, again); searchtext is None if cancelled
+        '''
 
-        self.searchdir = HexWindow.FORWARD
         searchtext = ''
 
         if not again:
-            self.search.prompt = '/'
             self.ignore_focus = True
-            self.search.show()
-            ret = self.search.runloop()
+            cmdbar.show()
+            ret = cmdbar.runloop()
             if ret != textmode.ENTER:
-                return
+                return None, again
 
-            searchtext = self.search.textfield.text
+            searchtext = cmdbar.textfield.text
             if not searchtext:
                 again = True
 
         if again:
             try:
-                searchtext = self.search.textfield.history[-1]
+                searchtext = cmdbar.textfield.history[-1]
             except IndexError:
-                return
+                return None, again
 
         if not searchtext:
+            return None, again
+
+        return searchtext, again
+
+    def set_search(self, key, matcher):
+        '''make matcher the current search
+        key identifies the search; the match index is kept only
+        if it belongs to the same search
+        '''
+
+        self.check_file()
+
+        self.matcher = matcher
+        if self.matchindex is not None and self.matchindex.key != key:
+            self.matchindex = None
+            self.draw_statusbar()
+
+        if self.matchindex is None:
+            self.matchindex = self.cached_index(key)
+            if self.matchindex is not None:
+                self.draw_statusbar()
+
+        if key != self.search_key:
+            self.search_key = key
+            if self.hlsearch:
+                # redraw for the new highlights
+                self.draw()
+
+    def check_file(self):
+        '''drop the match index if the file was changed
+        Returns file identity, or None if unknown
+        '''
+
+        try:
+            identity = search.file_identity(self.scanner.filename)
+        except OSError:
+            identity = None
+
+        if identity != self.file_id:
+            self.file_id = identity
+            if self.matchindex is not None:
+                self.matchindex = None
+                self.draw_statusbar()
+        return identity
+
+    def cached_result(self, *args):
+        '''Returns cached search result for the current file, or None'''
+
+        if self.file_id is None:
+            return None
+
+        return self.results.get((self.file_id,) + args)
+
+    def cache_result(self, value, *args):
+        '''store search result for the current file'''
+
+        if self.file_id is not None:
+            self.results.put((self.file_id,) + args, value)
+
+    def cached_index(self, key):
+        '''Returns complete match index from the result cache, or None'''
+
+        offsets = self.cached_result(key, 'all')
+        if offsets is None:
+            return None
+
+        index = search.MatchIndex(key)
+        index.offsets = offsets
+        index.complete = True
+        return index
+
+    def search_forward(self, again=False):
+        '''find next match of the current search from the cursor'''
+
+        if self.matcher is None:
             return
 
+        self.check_file()
+
+        matcher = self.matcher
         pos = self.address + self.cursor_y * self.linesize + self.cursor_x
         if again:
             pos += 1
 
-        try:
-            offset = self.data.find(searchtext, pos)
-        except ValueError:
-            # not found
-            offset = -1
+        offset = -1
+        index = self.matchindex
+        if index is not None:
+            idx = index.next(pos)
+            if idx != -1:
+                offset = index.offsets[idx]
+            elif not index.complete:
+                # beyond the partial index; scan the rest
+                index = None
+
+        if index is None:
+            offset = None
+            if not again:
+                # a new search from the same place finds the same match;
+                # repeats with n are not cached, they would churn the cache
+                offset = self.cached_result(self.search_key, 'next', pos)
+
+        if index is None and offset is None:
+            def find_forward(scanner):
+                '''search function'''
+                return scanner.find(matcher, pos)
+
+            try:
+                offset = self.run_search(find_forward)
+            except OSError as err:
+                self.search_error(err.strerror)
+                return
+
+            if offset is None:
+                # cancelled
+                return
+
+            if not again:
+                self.cache_result(offset, self.search_key, 'next', pos)
 
         if offset == -1:
             self.search_error('Not found')
             return
 
-        # text was found at offset
+        self.goto_match(offset, matcher.maxlen)
+
+    def search_backward(self):
+        '''find previous match of the current search from the cursor'''
+
+        if self.matcher is None:
+            return
+
+        self.check_file()
+
+        matcher = self.matcher
+        pos = self.address + self.cursor_y * self.linesize + self.cursor_x
+
+        offset = -1
+        index = self.matchindex
+        if index is not None:
+            if index.complete or (index.offsets and
+                                  pos <= index.offsets[-1] + 1):
+                idx = index.prev(pos)
+                if idx != -1:
+                    offset = index.offsets[idx]
+            else:
+                index = None
+
+        if index is None:
+            def find_backward(scanner):
+                '''search function'''
+                # matches that start before the cursor
+                for offset, _ in scanner.rfinditer(matcher,
+                                                   pos + matcher.maxlen - 1):
+                    if offset < pos:
+                        return offset
+                return -1
+
+            try:
+                offset = self.run_search(find_backward)
+            except OSError as err:
+                self.search_error(err.strerror)
+                return
+
+            if offset is None:
+                # cancelled
+                return
+
+        if offset == -1:
+            self.search_error('Not found')
+            return
+
+        self.goto_match(offset, matcher.maxlen)
+
+    def goto_match(self, offset, length):
+        '''move the cursor to match at offset'''
+
         self.clear_cursor()
         # if on the same page, move the cursor
         pagesize = self.bounds.h * self.linesize
-        if self.address < offset + len(searchtext) < self.address + pagesize:
+        if self.address < offset + length < self.address + pagesize:
             pass
         else:
             # scroll the page; change base address
@@ -1008,147 +1716,487 @@ class HexWindow(textmode.Window):
         self.cursor_x = diff % self.linesize
         self.draw_cursor()
 
+    def find(self, again=False):
+        '''text search'''
+
+        self.searchdir = HexWindow.FORWARD
+        self.search.prompt = '/'
+        if self.incsearch and not again:
+            self.incsearch_begin()
+            searchtext, again = self.read_search(self.search, again)
+            offset = self.incsearch_end(searchtext)
+        else:
+            searchtext, again = self.read_search(self.search, again)
+            offset = None
+        if searchtext is None:
+            return
+
+        if not self.set_text_search(searchtext):
+            return
+
+        if offset is not None:
+            # like the result of search_forward()
+            self.cache_result(offset, self.search_key, 'next',
+                              self.incsearch_origin())
+
+        if offset is None:
+            self.search_forward(again)
+        elif offset == -1:
+            self.search_error('Not found')
+
     def find_backwards(self, again=False):
         '''text search backwards'''
 
         self.searchdir = HexWindow.BACKWARD
-        searchtext = ''
+        self.search.prompt = '?'
+        searchtext, again = self.read_search(self.search, again)
+        if searchtext is None:
+            return
 
-        if not again:
-            self.search.prompt = '?'
-            self.ignore_focus = True
-            self.search.show()
-            ret = self.search.runloop()
-            if ret != textmode.ENTER:
-                return
+        if self.set_text_search(searchtext):
+            self.search_backward()
 
-            searchtext = self.search.textfield.text
-            if not searchtext:
-                again = True
+    def text_matcher(self, searchtext):
+        '''compile text search
+        A trailing \\c ignores case, \\C matches case
+        Returns tuple: (key, matcher)
+        Raises ValueError for invalid search
+        '''
 
-        if again:
+        ignorecase = self.ignorecase
+        if searchtext.endswith('\\c'):
+            searchtext = searchtext[:-2]
+            ignorecase = True
+        elif searchtext.endswith('\\C'):
+            searchtext = searchtext[:-2]
+            ignorecase = False
+
+        matcher = search.compile_text_pattern(searchtext, self.text_encoding,
+                                              ignorecase)
+        return ('text', searchtext, self.text_encoding, ignorecase), matcher
+
+    def set_text_search(self, searchtext):
+        '''make searchtext the current search
+        Returns False on error
+        '''
+
+        try:
+            key, matcher = self.text_matcher(searchtext)
+        except ValueError as err:
+            self.search_error(str(err))
+            return False
+
+        self.set_search(key, matcher)
+        return True
+
+    def incsearch_begin(self):
+        '''start incremental search from the cursor'''
+
+        self.check_file()
+        self.inc_origin = (self.address, self.cursor_x, self.cursor_y)
+        self.inc_job = None
+        self.inc_key = None
+        self.inc_result = None
+
+        textfield = self.search.textfield
+        textfield.on_change = self.incsearch_change
+        textfield.on_idle = self.incsearch_poll
+
+    def incsearch_end(self, searchtext):
+        '''end incremental search
+        Returns offset of the match for searchtext, -1 if not found,
+        or None if not known; the cursor is on the match if found
+        '''
+
+        textfield = self.search.textfield
+        textfield.on_change = textfield.on_idle = None
+
+        self.incsearch_poll()
+        self.incsearch_cancel()
+
+        result = None
+        if searchtext is not None and self.inc_key is not None:
             try:
-                searchtext = self.search.textfield.history[-1]
-            except IndexError:
-                return
+                key, _ = self.text_matcher(searchtext)
+            except ValueError:
+                key = None
+            if key == self.inc_key:
+                result = self.inc_result
+
+        if result is None or result == -1:
+            self.incsearch_restore()
+        return result
+
+    def incsearch_cancel(self):
+        '''stop the running scan
+        Remembers how far it got, so that a longer search text
+        can resume from there
+        '''
 
-        if not searchtext:
+        job = self.inc_job
+        if job is None:
             return
 
-        pos = self.address + self.cursor_y * self.linesize + self.cursor_x
+        self.inc_job = None
+        if job.wait(0):
+            if job.error is None:
+                self.incsearch_found(job.result)
+            return
+
+        job.cancel()
+        # matches that start before resume were ruled out
+        resume = (self.inc_start + job.scanner.scanned -
+                  self.inc_matcher.maxlen + 1)
+        if resume > self.inc_resume:
+            self.inc_resume = resume
+
+    def incsearch_found(self, offset):
+        '''the scan for the current search text finished'''
+
+        self.inc_result = offset
+        if offset == -1:
+            self.inc_resume = len(self.data)
+            self.incsearch_restore()
+        else:
+            self.inc_resume = offset
+            self.goto_match(offset, self.inc_matcher.maxlen)
+        self.search.textfield.draw_cursor()
+
+    def incsearch_origin(self):
+        '''Returns file offset where the incremental search started'''
+
+        address, cursor_x, cursor_y = self.inc_origin
+        return address + cursor_y * self.linesize + cursor_x
+
+    def incsearch_restore(self):
+        '''move back to where the incremental search started'''
+
+        address, cursor_x, cursor_y = self.inc_origin
+        self.clear_cursor()
+        if address != self.address:
+            self.address = address
+            self.draw()
+        self.cursor_x = cursor_x
+        self.cursor_y = cursor_y
+        self.draw_cursor()
+
+    def incsearch_change(self, text):
+        '''the search text changed; start a new scan'''
+
+        prev_key = self.inc_key
+        self.incsearch_cancel()
+
+        self.inc_key = None
+        self.inc_result = None
         try:
-            offset = bytearray_find_backwards(self.data, searchtext, pos)
+            key, matcher = self.text_matcher(text)
         except ValueError:
-            # not found
-            offset = -1
+            # like empty text
+            self.incsearch_restore()
+            self.search.textfield.draw_cursor()
+            return
 
-        if offset == -1:
-            self.search_error('Not found')
+        origin = self.incsearch_origin()
+        if (prev_key is None or prev_key[2:] != key[2:] or
+                not key[1].startswith(prev_key[1])):
+            # not an extension of the previous text; start over
+            self.inc_resume = origin
+
+        self.inc_key = key
+        self.inc_matcher = matcher
+        self.inc_start = start = self.inc_resume
+
+        # the same search from the same place was done before
+        offset = self.cached_result(key, 'next', origin)
+        if offset is not None:
+            self.incsearch_found(offset)
             return
 
-        # text was found at offset
-        self.clear_cursor()
-        # if on the same page, move the cursor
-        pagesize = self.bounds.h * self.linesize
-        if self.address < offset + len(searchtext) < self.address + pagesize:
-            pass
-        else:
-            # scroll the page; change base address
-            self.address = offset - self.bounds.h * 8
-            if self.address > len(self.data) - pagesize:
-                self.address = len(self.data) - pagesize
-            if self.address < 0:
-                self.address = 0
+        def find_forward(scanner):
+            '''search function'''
+            return scanner.find(matcher, start)
 
-            self.draw()
+        self.inc_job = search.SearchJob(self.scanner, find_forward)
+        # nearby matches show up without delay
+        self.inc_job.wait(HexWindow.INCSEARCH_DELAY)
+        self.incsearch_poll()
 
-        # move cursor location
-        diff = offset - self.address
-        self.cursor_y = diff // self.linesize
-        self.cursor_x = diff % self.linesize
-        self.draw_cursor()
+    def incsearch_poll(self):
+        '''check whether the running scan has finished'''
+
+        job = self.inc_job
+        if job is None or not job.wait(0):
+            return
+
+        self.inc_job = None
+        if job.error is None:
+            self.incsearch_found(job.result)
 
     def find_hex(self, again=False):
         '''search hex string'''
 
         self.searchdir = HexWindow.FORWARD
-        searchtext = ''
+        searchtext, again = self.read_search(self.hexsearch, again)
+        if searchtext is None:
+            return
 
-        if not again:
-            self.ignore_focus = True
-            self.hexsearch.show()
-            ret = self.hexsearch.runloop()
-            if ret != textmode.ENTER:
-                return
+        try:
+            matcher = search.compile_hex_pattern(searchtext)
+        except ValueError as err:
+            self.search_error(str(err))
+            return
 
-            searchtext = self.hexsearch.textfield.text
-            if not searchtext:
-                again = True
+        self.set_search(('hex', searchtext), matcher)
+        self.search_forward(again)
 
-        if again:
-            try:
-                searchtext = self.hexsearch.textfield.history[-1]
-            except IndexError:
+    def find_regex(self, pattern=None):
+        '''search regular expression'''
+
+        self.searchdir = HexWindow.FORWARD
+        again = False
+        if pattern is None:
+            pattern, again = self.read_search(self.regexsearch)
+            if pattern is None:
                 return
 
-        if not searchtext:
+        try:
+            matcher = search.RegexMatcher(pattern, OPT_REGEX_MAXLEN)
+        except (re.error, ValueError) as err:
+            self.search_error('Invalid regular expression: {}'.format(err))
             return
 
-        # convert ascii searchtext to raw byte string
-        searchtext = searchtext.replace(' ', '')
-        if not searchtext:
+        self.set_search(('regex', pattern, OPT_REGEX_MAXLEN), matcher)
+        self.search_forward(again)
+
+    def find_value(self, pattern=None):
+        '''search typed value, like 'uint32 = 0xDEADBEEF'
+        or 'float in [1.0, 2.0]', optionally followed by 'align N'
+        Values are read in the endianness of the values subwindow
+        '''
+
+        self.searchdir = HexWindow.FORWARD
+        again = False
+        if pattern is None:
+            pattern, again = self.read_search(self.valuesearch)
+            if pattern is None:
+                return
+
+        if self.valueview.endian == ValueSubWindow.BIG_ENDIAN:
+            byteorder = '>'
+        else:
+            byteorder = '<'
+
+        try:
+            matcher = search.compile_value_pattern(pattern, byteorder)
+        except ValueError as err:
+            self.search_error(str(err))
             return
 
-        if len(searchtext) & 1:
-            self.search_error('Invalid byte string (uneven number of digits)')
+        self.set_search(('value', pattern, byteorder), matcher)
+        self.search_forward(again)
+
+    def find_signatures(self, arg=None):
+        '''scan for many byte strings at once
+        Without argument, scan for common file signatures
+        Shows a list of hits to jump to
+        '''
+
+        if arg:
+            patterns = []
+            for text in arg.split():
+                try:
+                    patterns.append((text.upper(), bytes.fromhex(text)))
+                except ValueError:
+                    self.search_error("Invalid byte string '{}'".format(text))
+                    return
+        else:
+            patterns = search.SIGNATURES
+
+        try:
+            matcher = search.MultiMatcher(patterns)
+        except ValueError as err:
+            self.search_error(str(err))
             return
 
-        raw = ''
-        for x in range(0, len(searchtext), 2):
-            hex_string = searchtext[x:x + 2]
+        self.check_file()
+
+        key = ('signatures', arg)
+        index = self.cached_index(key)
+        if index is None:
+            index = search.MatchIndex(key)
+
+            def find_all(scanner):
+                '''search function'''
+                for offset, _ in scanner.finditer(matcher, 0):
+                    index.add(offset)
+                return len(index)
+
             try:
-                value = int(hex_string, self.linesize)
-            except ValueError:
-                self.search_error('Invalid value in byte string')
+                if self.run_search(find_all) is not None:
+                    index.complete = True
+                    self.cache_result(index.offsets, key, 'all')
+            except OSError as err:
+                self.search_error(err.strerror)
                 return
 
-            raw += chr(value)
+        if not index.offsets:
+            if index.complete:
+                self.search_error('Not found')
+            return
 
-        pos = self.address + self.cursor_y * self.linesize + self.cursor_x
-        if again:
-            pos += 1
+        self.searchdir = HexWindow.FORWARD
+        self.set_search(key, matcher)
+        self.matchindex = index
+        self.draw_statusbar()
+
+        self.show_matches(index, SignatureList(self.data, matcher, index,
+                                               self.address_fmt))
+
+    def minimap_jump(self):
+        '''move about in the minimap; jump to the chosen region'''
+
+        if self.minimap is None or self.minimap.map is None:
+            return
+
+        offset = self.minimap.runloop()
+        if offset >= 0:
+            self.goto_match(min(offset, len(self.data) - 1), 1)
+
+    def show_strings(self, arg=None):
+        '''list the strings in the file
+        The list fills while the file is scanned in the background
+        '''
+
+        minlen = HexWindow.STRINGS_MINLEN
+        if arg:
+            try:
+                minlen = int(arg)
+            except ValueError:
+                minlen = 0
 
         try:
-            offset = self.data.find(raw, pos)
-        except ValueError:
-            # not found
-            offset = -1
+            matcher = search.strings_matcher(minlen)
+        except ValueError as err:
+            self.search_error(str(err))
+            return
 
-        if offset == -1:
-            self.search_error('Not found')
+        self.check_file()
+        key = (self.file_id, minlen)
+        if self.strings is None or self.strings.key != key:
+            if self.strings_job is not None:
+                self.strings_job.cancel()
+
+            index = search.StringsIndex(key)
+
+            def find_strings(scanner):
+                '''search function'''
+                for offset, length in scanner.finditer(matcher, 0,
+                                                       overlapped=False):
+                    index.add(offset, length)
+                if not scanner.cancelled:
+                    index.complete = True
+                return len(index)
+
+            # use a scanner of its own, so that searching is still possible
+            scanner = search.Scanner(self.scanner.filename)
+            self.strings = index
+            self.strings_job = search.SearchJob(scanner, find_strings)
+
+        lines = StringsList(self.data, self.strings, self.address_fmt)
+        win = ListWindow(self, 'Strings', lines, poll=lines.update,
+                         filterable=True)
+        win.show()
+        idx = win.runloop()
+        win.close()
+
+        if 0 <= idx < len(lines):
+            entry = lines.entry(idx)
+            self.goto_match(self.strings.offsets[entry],
+                            self.strings.lengths[entry])
+
+    def show_matches(self, index, lines):
+        '''show list of matches; jump to the chosen one'''
+
+        win = ListWindow(self, 'Matches', lines)
+        win.show()
+        idx = win.runloop()
+        win.close()
+
+        if 0 <= idx < len(index):
+            self.goto_match(index.offsets[idx], self.matcher.maxlen)
+
+    def find_next(self):
+        '''search again in the same direction'''
+
+        if self.searchdir == HexWindow.FORWARD:
+            self.search_forward(again=True)
+        elif self.searchdir == HexWindow.BACKWARD:
+            self.search_backward()
+
+    def find_previous(self):
+        '''search again in the opposite direction'''
+
+        if self.searchdir == HexWindow.FORWARD:
+            self.search_backward()
+        elif self.searchdir == HexWindow.BACKWARD:
+            self.search_forward(again=True)
+
+    def find_all(self):
+        '''index all matches of the current search'''
+
+        if self.matcher is None:
+            self.search_error('No previous search')
             return
 
-        # text was found at offset
-        self.clear_cursor()
-        # if on the same page, move the cursor
-        pagesize = self.bounds.h * self.linesize
-        if self.address < offset + len(searchtext) < self.address + pagesize:
-            pass
-        else:
-            # scroll the page; change base address
-            self.address = offset - self.bounds.h * 8
-            if self.address > len(self.data) - pagesize:
-                self.address = len(self.data) - pagesize
-            if self.address < 0:
-                self.address = 0
+        self.check_file()
 
-            self.draw()
+        matcher = self.matcher
+        index = self.cached_index(self.search_key)
+        if index is None:
+            index = search.MatchIndex(self.search_key)
 
-        # move cursor location
-        diff = offset - self.address
-        self.cursor_y = diff // self.linesize
-        self.cursor_x = diff % self.linesize
-        self.draw_cursor()
+            # regex matches do not overlap, like with re.finditer()
+            overlapped = self.search_key[0] != 'regex'
+
+            def find_all(scanner):
+                '''search function'''
+                for offset, _ in scanner.finditer(matcher, 0,
+                                                  overlapped=overlapped):
+                    index.add(offset)
+                return len(index)
+
+            try:
+                if self.run_search(find_all) is not None:
+                    index.complete = True
+                    self.cache_result(index.offsets, index.key, 'all')
+            except OSError as err:
+                self.search_error(err.strerror)
+                return
+
+        # a cancelled scan leaves a partial index; keep it
+        if not index.offsets:
+            if index.complete:
+                self.search_error('Not found')
+            return
+
+        self.matchindex = index
+        self.search_forward()
+        self.draw_statusbar()
+
+    def match_status(self):
+        '''Returns match index status text'''
+
+        index = self.matchindex
+        total = '{:,}'.format(len(index))
+        if not index.complete:
+            total += '+'
+
+        pos = self.address + self.cursor_y * self.linesize + self.cursor_x
+        idx = index.find(pos)
+        if idx == -1:
+            return '{} matches'.format(total)
+
+        return 'match {:,} of {}'.format(idx + 1, total)
 
     def jump_address(self):
         '''jump to address'''
@@ -1468,6 +2516,54 @@ class HexWindow(textmode.Window):
         elif cmd == '0':
             self.move_home()
 
+        elif cmd == 'cache':
+            self.show_cache_stats()
+
+        elif cmd in ('findall', 'all'):
+            self.find_all()
+
+        elif cmd == 're':
+            if arg:
+                self.find_regex(arg)
+            else:
+                self.find_regex()
+
+        elif cmd in ('val', 'value'):
+            if arg:
+                self.find_value(arg)
+            else:
+                self.find_value()
+
+        elif cmd == 'strings':
+            self.show_strings(arg)
+
+        elif cmd in ('sig', 'signatures'):
+            self.find_signatures(arg)
+
+        elif cmd == 'remax':
+            self.set_regex_maxlen(arg)
+
+        elif cmd in ('hls', 'hlsearch'):
+            self.set_hlsearch(True)
+
+        elif cmd in ('nohls', 'nohlsearch', 'noh'):
+            self.set_hlsearch(False)
+
+        elif cmd in ('is', 'incsearch'):
+            self.incsearch = True
+
+        elif cmd in ('nois', 'noincsearch'):
+            self.incsearch = False
+
+        elif cmd in ('ic', 'ignorecase'):
+            self.ignorecase = True
+
+        elif cmd in ('noic', 'noignorecase'):
+            self.ignorecase = False
+
+        elif cmd in ('utf8', 'utf16le', 'utf16be', 'utf32le', 'utf32be'):
+            self.set_text_encoding(cmd[:3] + '-' + cmd[3:])
+
         else:
             self.ignore_focus = True
             self.cmdline.show()
@@ -1501,6 +2597,69 @@ class HexWindow(textmode.Window):
             self.draw()
             self.draw_cursor()
 
+    def set_regex_maxlen(self, arg):
+        '''set maximum match length for regex searches'''
+
+        global OPT_REGEX_MAXLEN
+
+        try:
+            maxlen = int(arg)
+            if maxlen < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            self.search_error('Invalid length; usage :remax NUMBER')
+            return
+
+        OPT_REGEX_MAXLEN = maxlen
+        if self.search_key is not None and self.search_key[0] == 'regex':
+            # the results of the old length stay under their own key
+            pattern = self.search_key[1]
+            self.set_search(('regex', pattern, maxlen),
+                            search.RegexMatcher(pattern, maxlen))
+
+    def set_hlsearch(self, enable):
+        '''turn highlighting of matches on or off'''
+
+        if self.hlsearch != enable:
+            self.hlsearch = enable
+            self.draw()
+            self.draw_cursor()
+
+    def set_text_encoding(self, encoding):
+        '''set encoding for text searches'''
+
+        encoding = encoding.lower()
+        if encoding not in search.TEXT_ENCODINGS:
+            self.search_error("Unknown encoding '{}'".format(encoding))
+            return
+
+        self.text_encoding = encoding
+
+    def show_cache_stats(self):
+        '''show block cache statistics in the command bar'''
+
+        total = self.data.hits + self.data.misses
+        if total > 0:
+            ratio = 100.0 * self.data.hits / total
+        else:
+            ratio = 0.0
+        msg = 'cache: {} hits, {} misses ({:.1f}% hit ratio)'.format(
+            self.data.hits, self.data.misses, ratio)
+        if isinstance(self.data, MmapMemoryFile):
+            msg += ', mmap window {} MiB'.format(
+                (self.data.high - self.data.low) // (1024 * 1024))
+        else:
+            msg += ', {} of {} blocks in use'.format(len(self.data.blocks),
+                                                    self.data.maxblocks)
+        msg += '; rows: {} hits, {} misses'.format(self.rows.hits,
+                                                    self.rows.misses)
+
+        self.ignore_focus = True
+        self.cmdline.show()
+        self.cmdline.cputs(0, 0, msg, textmode.video_color(WHITE, BLACK))
+        getch()
+        self.cmdline.hide()
+
     def show_help(self):
         '''show help window'''
 
@@ -1609,7 +2768,14 @@ class HexWindow(textmode.Window):
             self.old_x = self.cursor_x
             self.old_y = self.cursor_y
 
-            key = getch()
+            if self.minimap is not None and self.minimap.busy():
+                # refine the minimap while idle
+                key = getch(timeout=250)
+                if key is None:
+                    self.minimap.update()
+                    continue
+            else:
+                key = getch()
 
             if key == KEY_ESC:
                 if self.mode & HexWindow.MODE_SELECT:
@@ -1669,14 +2835,24 @@ class HexWindow(textmode.Window):
 
             elif key == 'n' or key == 'Ctrl-G':             # pylint: disable=consider-using-in
                 # search again
-                if self.searchdir == HexWindow.FORWARD:
-                    self.find(again=True)
-                elif self.searchdir == HexWindow.BACKWARD:
-                    self.find_backwards(again=True)
+                self.find_next()
+
+            elif key == 'N':
+                # search again in opposite direction
+                self.find_previous()
+
+            elif key == '&':
+                self.find_all()
 
             elif key == 'x' or key == 'Ctrl-X':             # pylint: disable=consider-using-in
                 self.find_hex()
 
+            elif key == 'r':
+                self.find_regex()
+
+            elif key == 'V':
+                self.find_value()
+
             elif key == '0' or key == '^':                  # pylint: disable=consider-using-in
                 self.move_begin_line()
 
@@ -1716,6 +2892,189 @@ class HexWindow(textmode.Window):
             elif key == 'P':
                 self.toggle_endianness()
 
+            elif key == KEY_TAB:
+                self.minimap_jump()
+
+
+
+class MiniMap(textmode.Window):
+    '''map of the whole file, next to the hex view
+    Every line is a region of the file; the color shows its byte
+    class and the length of the bar shows its entropy
+    '''
+
+    MIN_WIDTH = 4
+
+    # byte class: (char, foreground, background)
+    CLASSES = {entropy.ZERO: ('.', BLUE, BLACK),
+               entropy.ASCII: ('a', BLACK, GREEN),
+               entropy.HIGHBIT: ('h', BLACK, YELLOW),
+               entropy.RANDOM: ('#', WHITE, RED),
+               entropy.BINARY: (':', BLACK, CYAN)}
+
+    def __init__(self, x, y, w, h, colors):
+        '''initialize'''
+
+        super().__init__(x, y, w, h, colors, border=True, shadow=False)
+
+        self.map = None
+        self.filename = None
+        self.generation = -1
+        # lines that show the current view
+        self.view_top = self.view_bottom = 0
+        # line of the cursor, or -1 when not active
+        self.cursor = -1
+
+    def load(self, filename):
+        '''start computing the map for file'''
+
+        self.stop()
+        self.filename = filename
+        self.generation = -1
+        try:
+            self.map = entropy.EntropyMap(filename, self.bounds.h)
+        except OSError:
+            self.map = None
+        self.draw()
+
+    def stop(self):
+        '''stop computing'''
+
+        if self.map is not None:
+            self.map.cancel()
+
+    def busy(self):
+        '''Returns True while the map is being refined'''
+
+        return self.map is not None and self.map.busy()
+
+    def resize_event(self):
+        '''the terminal was resized'''
+
+        h = textmode.VIDEO.h - 1 - self.frame.y
+        if h == self.frame.h:
+            return
+
+        self.frame.h = self.rect.h = h
+        self.bounds.h = h - 2 if self.has_border else h
+        # the number of regions changed
+        if self.filename is not None:
+            self.load(self.filename)
+
+    def draw(self):
+        '''draw the minimap'''
+
+        if not self.flags & textmode.Window.SHOWN:
+            return
+
+        super().draw()
+
+        for y in range(self.bounds.h):
+            self.draw_line(y)
+
+    def draw_line(self, y):
+        '''draw line of the map'''
+
+        if self.map is None or y >= self.map.regions:
+            return
+
+        if y == self.cursor:
+            marker = '>'
+            color = self.colors.cursor
+        elif self.view_top <= y <= self.view_bottom:
+            marker = '>'
+            color = self.colors.text
+        else:
+            marker = ' '
+            color = self.colors.text
+        self.puts(0, y, marker, color)
+
+        w = self.bounds.w - 1
+        stats = self.map.stats[y]
+        if stats is None:
+            self.puts(1, y, ' ' * w)
+            return
+
+        byteclass, bits = stats
+        n = max(1, min(w, int(bits / 8.0 * w + 0.5)))
+        ch, fg, bg = MiniMap.CLASSES[byteclass]
+        self.puts(1, y, ch * n, textmode.video_color(fg, bg))
+        self.puts(1 + n, y, ' ' * (w - n))
+
+    def update(self):
+        '''redraw if the map was refined'''
+
+        if self.map is not None and self.map.generation != self.generation:
+            self.generation = self.map.generation
+            self.draw()
+
+    def set_view(self, address, length):
+        '''mark the lines that show the view'''
+
+        if self.map is None:
+            return
+
+        last = self.map.regions - 1
+        top = min(self.map.region(address), last)
+        bottom = min(self.map.region(address + max(length, 1) - 1), last)
+        if (top, bottom) == (self.view_top, self.view_bottom):
+            return
+
+        old_top, old_bottom = self.view_top, self.view_bottom
+        self.view_top, self.view_bottom = top, bottom
+        for y in range(old_top, old_bottom + 1):
+            self.draw_line(y)
+        for y in range(top, bottom + 1):
+            self.draw_line(y)
+
+    def move_cursor(self, y):
+        '''move the cursor to line y'''
+
+        y = max(0, min(y, self.map.regions - 1))
+        old = self.cursor
+        self.cursor = y
+        if old != -1:
+            self.draw_line(old)
+        self.draw_line(y)
+
+    def runloop(self):
+        '''move the cursor about the map
+        Returns file offset of the chosen region, or -1
+        '''
+
+        self.move_cursor(self.view_top)
+        try:
+            while True:
+                if self.busy():
+                    key = getch(timeout=250)
+                    if key is None:
+                        self.update()
+                        continue
+                else:
+                    key = getch()
+
+                if key in (KEY_ESC, KEY_TAB, 'q'):
+                    return -1
+
+                if key == KEY_RETURN:
+                    return self.cursor * self.map.regionsize
+
+                if key == KEY_UP or key == 'k':                     # pylint: disable=consider-using-in
+                    self.move_cursor(self.cursor - 1)
+
+                elif key == KEY_DOWN or key == 'j':                 # pylint: disable=consider-using-in
+                    self.move_cursor(self.cursor + 1)
+
+                elif key == KEY_HOME or key == 'g':                 # pylint: disable=consider-using-in
+                    self.move_cursor(0)
+
+                elif key == KEY_END or key == 'G':                  # pylint: disable=consider-using-in
+                    self.move_cursor(self.map.regions - 1)
+        finally:
+            old = self.cursor
+            self.cursor = -1
+            self.draw_line(old)
+
 
 
 class ValueSubWindow(textmode.Window):
@@ -1811,32 +3170,17 @@ class ValueSubWindow(textmode.Window):
 
 
 
-def bytearray_find_backwards(data, search, pos=-1):
-    '''search bytearray backwards for string
-    Returns index if found or -1 if not found
-    May raise ValueError for invalid search
-    '''
-
-    if data is None or not data:
-        raise ValueError
-
-    if search is None or not search:
-        raise ValueError
-
-    if pos == -1:
-        pos = len(data)
-
-    if pos < 0:
-        return ValueError
+def search_progress(job):
+    '''Returns progress message for search job'''
 
-    pos -= len(search)
-    while pos >= 0:
-        if data[pos:pos + len(search)] == search:
-            return pos
+    scanned, total, rate = job.progress()
+    if total > 0:
+        percent = 100.0 * scanned / total
+    else:
+        percent = 100.0
 
-        pos -= 1
-
-    return -1
+    return 'Searching ... {:,} MiB  {:.0f}%  {:.1f} MB/s  (Esc to cancel)'.format(
+        scanned // (1024 * 1024), percent, rate / 1e6)
 
 
 def hex_inputfilter(key):
@@ -1856,6 +3200,19 @@ def hex_inputfilter(key):
     return None
 
 
+def hexpattern_inputfilter(key):
+    '''input filter for hex search patterns
+    Same as hex_inputfilter, but allows '?' wildcards and
+    '~' for the number of mismatches
+    Returns character or None if invalid
+    '''
+
+    if key in ('?', '~'):
+        return key
+
+    return hex_inputfilter(key)
+
+
 def isalphanum(ch):
     '''Returns True if character is alphanumeric'''
 
@@ -1913,8 +3270,19 @@ class CommandBar(textmode.CmdLine):
 class CommandField(textmode.TextField):
     '''command bar edit field
     Same as TextField, but backspace can exit the command mode
+    on_change is called with the text whenever it changes;
+    on_idle is called now and then while no key is pressed
     '''
 
+    def __init__(self, parent, x, y, w, colors, history=True,
+                 inputfilter=None):
+        '''initialize'''
+
+        super().__init__(parent, x, y, w, colors, history, inputfilter)
+
+        self.on_change = None
+        self.on_idle = None
+
     def runloop(self):
         '''run the CommandField
         Same as TextField, but backspace can exit
@@ -1928,7 +3296,15 @@ class CommandField(textmode.TextField):
         self.gain_focus()
 
         while True:
-            key = getch()
+            text = self.text
+            if self.on_idle is not None:
+                key = getch(timeout=50)
+                if key is None:
+                    self.on_idle()
+                    continue
+            else:
+                key = getch()
+
             if key == KEY_ESC:
                 self.text = ''
                 self.cursor = 0
@@ -2015,6 +3391,9 @@ class CommandField(textmode.TextField):
                     self.cursor += 1
                     self.draw()
 
+            if self.on_change is not None and self.text != text:
+                self.on_change(self.text)
+
 
 
 class HelpWindow(textmode.TextWindow):
@@ -2030,8 +3409,19 @@ class HelpWindow(textmode.TextWindow):
  /        Ctrl-F      Find
  ?                    Find backwards
  n        Ctrl-G      Find again
- x        Ctrl-X      Find hexadecimal
+ N                    Find again in opposite direction
+ &                    Find all; count and index matches
+ x        Ctrl-X      Find hexadecimal; use ?? or
+                            4? for wildcards, end with
+                            ~K to allow K mismatches
+ r                    Find regular expression;
+                            . matches any byte
+ V                    Find value; like uint32 = 7
+                            or float in [1.0, 2.0],
+                            with optional align N
  t                    Toggle char interpretation
+ Tab                  Move in the minimap; Enter
+                            jumps to the region
 
  1                    View single bytes
  2                    View 16-bit words
@@ -2066,6 +3456,23 @@ class HelpWindow(textmode.TextWindow):
 
 Commands
  :0                   Go to top
+ :cache               Show block cache statistics
+ :findall :all        Find all; count and index matches
+ :re PATTERN          Find regular expression
+ :remax NUMBER        Set longest regex match length
+ :val PATTERN         Find typed value
+ :strings [NUMBER]    List ASCII and UTF-16 strings
+                            of at least NUMBER chars
+ :sig                 Scan for common file signatures
+ :sig HEX [HEX ..]    Scan for several byte strings
+ :is      :nois       Search while typing (default on)
+ :ic      :noic       Ignore case in text searches;
+                            end text with \\c or \\C to
+                            override
+ :utf8    :utf16le    Text search encoding; also
+ :utf16be             :utf32le and :utf32be
+ :hls                 Highlight all matches on screen
+ :nohls   :noh        Do not highlight matches
  :print   :values     Toggle printed values
  :big                 Set big endian mode
  :little              Set little endian mode
@@ -2154,6 +3561,225 @@ Commands
 
 
 
+class SignatureList:
+    '''lines for a list of signature matches
+    Lines are formatted on demand
+    '''
+
+    def __init__(self, data, matcher, index, address_fmt):
+        '''initialize'''
+
+        self.data = data
+        self.matcher = matcher
+        self.index = index
+        self.address_fmt = address_fmt
+
+    def __len__(self):
+        '''Returns number of lines'''
+
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        '''Returns line at idx'''
+
+        if not 0 <= idx < len(self.index):
+            raise IndexError('list index out of range')
+
+        offset = self.index.offsets[idx]
+        name = self.matcher.identify(self.data.read(offset,
+                                                    self.matcher.maxlen))
+        return ' ' + self.address_fmt.format(offset) + str(name)
+
+
+
+class StringsList:
+    '''lines for a strings index
+    Lines are formatted on demand, and the index may still grow.
+    With a filter, only strings that contain the filter text are listed
+    '''
+
+    # number of strings to filter per update
+    FILTER_STEP = 10000
+
+    def __init__(self, data, index, address_fmt):
+        '''initialize'''
+
+        self.data = data
+        self.index = index
+        self.address_fmt = address_fmt
+        self.filter = None
+        # entries that pass the filter
+        self.selection = array.array('Q')
+        # number of entries checked against the filter
+        self.checked = 0
+        self.count = len(index)
+
+    def __len__(self):
+        '''Returns number of lines'''
+
+        if self.filter is None:
+            return self.count
+        return len(self.selection)
+
+    def __getitem__(self, idx):
+        '''Returns line at idx'''
+
+        if not 0 <= idx < len(self):
+            raise IndexError('list index out of range')
+
+        entry = self.entry(idx)
+        offset = self.index.offsets[entry]
+        return ' ' + self.address_fmt.format(offset) + self.string(entry)
+
+    def entry(self, idx):
+        '''Returns index entry for line idx'''
+
+        if self.filter is None:
+            return idx
+        return self.selection[idx]
+
+    def string(self, entry):
+        '''Returns string for index entry'''
+
+        data = self.data.read(self.index.offsets[entry],
+                              self.index.lengths[entry])
+        if len(data) > 1 and data[1] == 0:
+            return bytes(data).decode('utf-16-le', 'replace')
+        return bytes(data).decode('ascii', 'replace')
+
+    def set_filter(self, text):
+        '''only list strings that contain text (ignoring case)'''
+
+        if text:
+            self.filter = text.lower()
+        else:
+            self.filter = None
+        self.selection = array.array('Q')
+        self.checked = 0
+        self.update()
+
+    def update(self):
+        '''take in new strings from the index
+        Returns True if the list changed
+        '''
+
+        count = len(self.index)
+        if self.filter is None:
+            changed = count != self.count
+            self.count = count
+            return changed
+
+        # filter a limited number at a time, to stay responsive
+        end = min(count, self.checked + StringsList.FILTER_STEP)
+        before = len(self.selection)
+        for entry in range(self.checked, end):
+            if self.filter in self.string(entry).lower():
+                self.selection.append(entry)
+        self.checked = end
+        return len(self.selection) != before
+
+
+
+class ListWindow(textmode.TextWindow):
+    '''shows a list of lines to choose from
+    If poll is given, it is called while idle; it returns True
+    if the lines changed. If filterable, '/' sets a filter
+    '''
+
+    def __init__(self, parent, title, lines, poll=None, filterable=False):
+        '''initialize'''
+
+        self.parent = parent
+        self.poll = poll
+        self.filterable = filterable
+
+        colors = textmode.ColorSet(BLACK, WHITE)
+        colors.title = textmode.video_color(RED, WHITE)
+        colors.cursor = textmode.video_color(BLACK, GREEN)
+
+        w = 52
+        h = textmode.VIDEO.h - 6
+        if h < 4:
+            h = 4
+        x = textmode.center_x(w, self.parent.frame.w)
+        y = textmode.center_y(h, textmode.VIDEO.h)
+
+        super().__init__(x, y, w, h, colors, title=title, border=True,
+                         text=lines, scrollbar=False, status=True)
+
+        self.filterbar = CommandBar(self.parent.colors, prompt='filter/')
+
+    def draw_cursor(self):
+        '''redraw the cursor line'''
+
+        super().draw_cursor()
+        if self.text:
+            pos = self.top + self.cursor + 1
+        else:
+            pos = 0
+        self.update_statusbar(' {} of {} '.format(pos, len(self.text)))
+
+    def set_filter(self):
+        '''read filter text and apply it'''
+
+        self.filterbar.show()
+        ret = self.filterbar.runloop()
+        self.filterbar.hide()
+        if ret != textmode.ENTER:
+            return
+
+        self.text.set_filter(self.filterbar.textfield.text)
+        self.top = self.cursor = 0
+        self.draw()
+        self.draw_cursor()
+
+    def runloop(self):
+        '''run the list window
+        Returns index of the chosen line, or RETURN_TO_PREVIOUS
+        '''
+
+        while True:
+            if self.poll is not None:
+                key = getch(timeout=200)
+                if key is None:
+                    if self.poll():
+                        self.draw()
+                        self.draw_cursor()
+                    continue
+            else:
+                key = getch()
+
+            if key == '/' and self.filterable:
+                self.set_filter()
+
+            elif key == KEY_ESC or key == 'q':                        # pylint: disable=consider-using-in
+                self.lose_focus()
+                return textmode.RETURN_TO_PREVIOUS
+
+            if key == KEY_RETURN:
+                self.lose_focus()
+                return self.top + self.cursor
+
+            if key == KEY_UP or key == 'k':                         # pylint: disable=consider-using-in
+                self.move_up()
+
+            elif key == KEY_DOWN or key == 'j':                     # pylint: disable=consider-using-in
+                self.move_down()
+
+            elif key == KEY_PAGEUP or key == 'Ctrl-U':              # pylint: disable=consider-using-in
+                self.pageup()
+
+            elif key == KEY_PAGEDOWN or key == 'Ctrl-D':            # pylint: disable=consider-using-in
+                self.pagedown()
+
+            elif key == KEY_HOME or key == 'g':                     # pylint: disable=consider-using-in
+                self.goto_top()
+
+            elif key == KEY_END or key == 'G':                      # pylint: disable=consider-using-in
+                self.goto_bottom()
+
+
+
 class LicenseBox(textmode.Alert):
     '''shows software license'''
 
@@ -2237,6 +3863,7 @@ def hexview_main(filename):
     colors.cursor = textmode.video_color(WHITE, BLACK, bold=True)
     colors.status = colors.cursor
     colors.invisibles = textmode.video_color(BLUE, CYAN, bold=True)
+    colors.highlight = textmode.video_color(BLACK, YELLOW)
 
     width = OPT_FORCE_WINDOW_WIDTH if OPT_FORCE_WINDOW_WIDTH else textmode.VIDEO.w
     view = HexWindow(0, 0, width, textmode.VIDEO.h - 1, colors)
@@ -2252,7 +3879,13 @@ def hexview_main(filename):
     textmode.VIDEO.puts(0, textmode.VIDEO.h - 1,
                         'Enter :help for usage information',
                         textmode.video_color(WHITE, BLACK))
-    view.runloop()
+    try:
+        view.runloop()
+    except SystemExit:
+        # Ctrl-Q bails out without closing the window
+        view.save_results()
+        raise
+    view.close()
 
 
 def short_usage():
@@ -2273,9 +3906,18 @@ def usage():
       --no-lines       Disable all line drawing
       --no-hlines      Disable horizontal lines
       --no-vlines      Disable vertical lines
+      --ansi           Draw the screen with ANSI escapes rather than curses
+      --no-retained    Send every screen update to curses right away
   -v, --version        Display version and exit
       --ebcdic         Interpret printable chars as EBCDIC
       --80             Force 80-column mode even for wider terminals
+      --mmap           Access the file through memory mapping
+      --cache-size=MB  Memory budget for the block cache (default: 16)
+      --no-readahead   Do not read ahead in the background
+      --regex-max=NUM  Longest match for regex searches (default: 256)
+      --jobs=NUM       Search using NUM processes (default: 1)
+      --search-cache=FILE
+                       Keep search results in FILE across sessions
 ''')
     sys.exit(1)
 
@@ -2283,17 +3925,23 @@ def usage():
 def get_options():
     '''parse command line options'''
 
-    global OPT_LINEMODE, OPT_ENCODING, OPT_FORCE_WINDOW_WIDTH
+    global OPT_LINEMODE, OPT_ENCODING, OPT_FORCE_WINDOW_WIDTH, OPT_MMAP
+    global OPT_CACHESIZE, OPT_READAHEAD, OPT_REGEX_MAXLEN, OPT_JOBS
+    global OPT_SEARCH_CACHE
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], 'hv',
                                    ['help', 'no-color', 'no-lines',
                                     'ascii-lines', 'no-hlines', 'no-vlines',
-                                    'version', 'ebcdic', '80'])
+                                    'ansi', 'no-retained',
+                                    'version', 'ebcdic', '80', 'mmap',
+                                    'cache-size=', 'no-readahead',
+                                    'regex-max=', 'jobs=',
+                                    'search-cache='])
     except getopt.GetoptError:
         short_usage()
 
-    for opt, _ in opts:
+    for opt, arg in opts:
         if opt in ('-h', '--help'):
             usage()
 
@@ -2311,6 +3959,12 @@ def get_options():
 
         elif opt == '--no-vlines':
             OPT_LINEMODE &= ~textmode.LM_VLINE
+
+        elif opt == '--ansi':
+            textmode.ANSI_OUTPUT = True
+
+        elif opt == '--no-retained':
+            textmode.RETAINED_MODE = False
         
         elif opt == '--ebcdic':
             OPT_ENCODING = CHAR_ENCODINGS['cp500']
@@ -2318,6 +3972,39 @@ def get_options():
         elif opt == '--80':
             OPT_FORCE_WINDOW_WIDTH = 80
 
+        elif opt == '--mmap':
+            OPT_MMAP = True
+
+        elif opt == '--no-readahead':
+            OPT_READAHEAD = False
+
+        elif opt == '--regex-max':
+            try:
+                OPT_REGEX_MAXLEN = int(arg)
+            except ValueError:
+                short_usage()
+            if OPT_REGEX_MAXLEN < 1:
+                short_usage()
+
+        elif opt == '--jobs':
+            try:
+                OPT_JOBS = int(arg)
+            except ValueError:
+                short_usage()
+            if OPT_JOBS < 1:
+                short_usage()
+
+        elif opt == '--search-cache':
+            OPT_SEARCH_CACHE = os.path.expanduser(arg)
+
+        elif opt == '--cache-size':
+            try:
+                OPT_CACHESIZE = int(arg) * 1024 * 1024
+            except ValueError:
+                short_usage()
+            if OPT_CACHESIZE < 0:
+                short_usage()
+
         elif opt in ('-v', '--version'):
             print('hexview version {}'.format(VERSION))
             print('Copyright 2016 by Walter de Jong <walter@heiho.net>')
@@ -0,0 +1,1542 @@
+#
+#   search.py
+#
+#   Copyright 2016 by Walter de Jong <walter@heiho.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''search engines that stream through files'''
+
+import os
+import re
+import math
+import atexit
+import time
+import array
+import struct
+import bisect
+import threading
+import json
+import collections
+import multiprocessing
+import concurrent.futures
+
+
+class LiteralMatcher:
+    '''matches a literal byte string
+
+    Matchers look for matches in a buffer. A match is reported only
+    if it starts in buf[start:stop] and lies entirely within buf[:size]
+    Matchers with align > 1 only try start + k * align; the scanner
+    passes a start that is aligned in the file
+    '''
+
+    def __init__(self, pattern):
+        '''initialize'''
+
+        if isinstance(pattern, str):
+            pattern = bytes(pattern, 'utf-8')
+
+        if not pattern:
+            raise ValueError('empty search pattern')
+
+        self.pattern = bytes(pattern)
+        # the longest possible match; determines chunk overlap
+        self.maxlen = len(self.pattern)
+        self.align = 1
+
+    def find(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of first match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        idx = buf.find(self.pattern, start, end)
+        if idx == -1:
+            return -1, 0
+
+        return idx, self.maxlen
+
+    def rfind(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of last match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        idx = buf.rfind(self.pattern, start, end)
+        if idx == -1:
+            return -1, 0
+
+        return idx, self.maxlen
+
+
+
+class HexPatternMatcher:
+    '''matches a hex pattern with wildcard bytes and nibbles
+    The longest run of exact bytes in the pattern is used as an anchor;
+    candidates found with a fast literal search are then verified
+    against the masked pattern. Patterns without any exact bytes
+    are matched with an equivalent regular expression
+    '''
+
+    def __init__(self, values, masks):
+        '''initialize
+        values and masks are byte strings of equal length
+        '''
+
+        if not values or len(values) != len(masks):
+            raise ValueError('invalid hex pattern')
+
+        self.values = bytes(values)
+        self.masks = bytes(masks)
+        self.maxlen = len(self.values)
+        self.align = 1
+
+        # find the longest run of exact bytes
+        anchor_pos = anchor_len = 0
+        run_pos = run_len = 0
+        for i, mask in enumerate(self.masks):
+            if mask == 0xff:
+                if not run_len:
+                    run_pos = i
+                run_len += 1
+                if run_len > anchor_len:
+                    anchor_pos, anchor_len = run_pos, run_len
+            else:
+                run_len = 0
+
+        self.anchor_pos = anchor_pos
+        self.anchor = self.values[anchor_pos:anchor_pos + anchor_len]
+
+        # the bytes that remain to be verified
+        self.checks = [(i, self.values[i], self.masks[i])
+                       for i in range(0, self.maxlen)
+                       if self.masks[i] and
+                       not anchor_pos <= i < anchor_pos + anchor_len]
+
+        self.regex = None
+        if not self.anchor:
+            self.regex = re.compile(self.regex_pattern(), re.DOTALL)
+
+    def regex_pattern(self):
+        '''Returns equivalent regular expression as bytes'''
+
+        parts = []
+        for value, mask in zip(self.values, self.masks):
+            if mask == 0xff:
+                parts.append(re.escape(bytes([value])))
+            elif mask == 0:
+                parts.append(b'.')
+            else:
+                alternatives = b''.join(re.escape(bytes([x]))
+                                        for x in range(0, 256)
+                                        if x & mask == value)
+                parts.append(b'[' + alternatives + b']')
+
+        return b''.join(parts)
+
+    def verify(self, buf, idx):
+        '''Returns True if the pattern matches at idx
+        The caller makes sure that the pattern fits in the buffer
+        '''
+
+        for i, value, mask in self.checks:
+            if buf[idx + i] & mask != value:
+                return False
+
+        return True
+
+    def find(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of first match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        if self.regex is not None:
+            m = self.regex.search(buf, start, end)
+            if m is None:
+                return -1, 0
+            return m.start(), self.maxlen
+
+        # matches start before last, so that they end within size;
+        # the anchor is found between those bounds only
+        last = end - self.maxlen + 1
+        if last <= start:
+            return -1, 0
+
+        pos = start + self.anchor_pos
+        limit = last + self.anchor_pos + len(self.anchor) - 1
+        while True:
+            idx = buf.find(self.anchor, pos, limit)
+            if idx == -1:
+                return -1, 0
+
+            if self.verify(buf, idx - self.anchor_pos):
+                return idx - self.anchor_pos, self.maxlen
+
+            pos = idx + 1
+
+    def rfind(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of last match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        if self.regex is not None:
+            last = -1
+            m = self.regex.search(buf, start, end)
+            while m is not None:
+                last = m.start()
+                m = self.regex.search(buf, last + 1, end)
+            if last == -1:
+                return -1, 0
+            return last, self.maxlen
+
+        last = end - self.maxlen + 1
+        if last <= start:
+            return -1, 0
+
+        limit = last + self.anchor_pos + len(self.anchor) - 1
+        while True:
+            idx = buf.rfind(self.anchor, start + self.anchor_pos, limit)
+            if idx == -1:
+                return -1, 0
+
+            if self.verify(buf, idx - self.anchor_pos):
+                return idx - self.anchor_pos, self.maxlen
+
+            limit = idx + len(self.anchor) - 1
+
+
+
+class ApproxMatcher:
+    '''matches a byte string with at most k mismatching bytes
+    The pattern is split into k + 1 pieces; a match contains at least
+    one of them unchanged. Pieces are found by literal search and
+    only those places are verified
+    '''
+
+    def __init__(self, pattern, k):
+        '''initialize
+        Raises ValueError if k is out of range
+        '''
+
+        if not pattern:
+            raise ValueError('empty search pattern')
+
+        if k < 0 or k >= len(pattern):
+            raise ValueError('Too many mismatches for pattern length')
+
+        self.pattern = bytes(pattern)
+        self.k = k
+        self.maxlen = len(self.pattern)
+        self.align = 1
+
+        # list of tuples: (offset in pattern, piece)
+        self.pieces = []
+        for i in range(k + 1):
+            lo = i * self.maxlen // (k + 1)
+            hi = (i + 1) * self.maxlen // (k + 1)
+            self.pieces.append((lo, self.pattern[lo:hi]))
+
+    def verify(self, buf, idx):
+        '''Returns True if the pattern matches at idx
+        The caller makes sure that the pattern fits in the buffer
+        '''
+
+        errors = 0
+        for a, b in zip(self.pattern, buf[idx:idx + self.maxlen]):
+            if a != b:
+                errors += 1
+                if errors > self.k:
+                    return False
+        return True
+
+    def find(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of first match
+        or (-1, 0) if not found
+        '''
+
+        # matches must start before last
+        last = size - self.maxlen + 1
+        if last > stop:
+            last = stop
+        if last <= start:
+            return -1, 0
+
+        best = -1
+        for offset, piece in self.pieces:
+            if best != -1:
+                # only look for an earlier match
+                last = best
+            pos = start + offset
+            end = last + offset + len(piece) - 1
+            while True:
+                idx = buf.find(piece, pos, end)
+                if idx == -1:
+                    break
+
+                if self.verify(buf, idx - offset):
+                    best = idx - offset
+                    break
+                pos = idx + 1
+
+        if best == -1:
+            return -1, 0
+
+        return best, self.maxlen
+
+    def rfind(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of last match
+        or (-1, 0) if not found
+        '''
+
+        last = size - self.maxlen + 1
+        if last > stop:
+            last = stop
+        if last <= start:
+            return -1, 0
+
+        best = -1
+        for offset, piece in self.pieces:
+            if best != -1:
+                # only look for a later match
+                start = best + 1
+            pos = start + offset
+            end = last + offset + len(piece) - 1
+            while True:
+                idx = buf.rfind(piece, pos, end)
+                if idx == -1:
+                    break
+
+                if self.verify(buf, idx - offset):
+                    best = idx - offset
+                    break
+                end = idx + len(piece) - 1
+
+        if best == -1:
+            return -1, 0
+
+        # the backward scan relies on this to make progress
+        assert best < stop
+        return best, self.maxlen
+
+
+
+class RegexMatcher:
+    '''matches a regular expression over bytes
+    Matches are limited to maxlen bytes; this determines
+    the overlap between chunks. The dot matches any byte,
+    including newline. Zero-length matches are skipped
+    '''
+
+    def __init__(self, pattern, maxlen=256, flags=0):
+        '''initialize
+        Raises re.error for invalid pattern
+        Raises ValueError if the pattern matches the empty string
+        '''
+
+        if isinstance(pattern, str):
+            pattern = bytes(pattern, 'utf-8')
+
+        if not pattern:
+            raise ValueError('empty search pattern')
+
+        self.regex = re.compile(pattern, flags | re.DOTALL)
+        if self.regex.fullmatch(b'') is not None:
+            raise ValueError('pattern matches the empty string')
+
+        self.maxlen = maxlen
+        self.align = 1
+
+    def search(self, buf, start, end):
+        '''Returns first match object that is not empty, or None'''
+
+        m = self.regex.search(buf, start, end)
+        while m is not None and m.start() == m.end():
+            m = self.regex.search(buf, m.start() + 1, end)
+        return m
+
+    def find(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of first match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        m = self.search(buf, start, end)
+        if m is None or m.start() >= stop:
+            return -1, 0
+
+        return m.start(), m.end() - m.start()
+
+    def rfind(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of last match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        last = None
+        m = self.search(buf, start, end)
+        while m is not None and m.start() < stop:
+            last = m
+            m = self.search(buf, m.start() + 1, end)
+
+        if last is None:
+            return -1, 0
+
+        return last.start(), last.end() - last.start()
+
+
+
+class MultiMatcher(RegexMatcher):
+    '''matches any of a set of byte strings in a single pass
+    patterns is a list of tuples: (name, byte string)
+    '''
+
+    def __init__(self, patterns):
+        '''initialize'''
+
+        if not patterns:
+            raise ValueError('no search patterns')
+
+        self.patterns = [(name, bytes(pattern)) for name, pattern in patterns]
+        if not all(pattern for _, pattern in self.patterns):
+            raise ValueError('empty search pattern')
+
+        # prefer the longest pattern when several match at the same offset
+        ordered = sorted(set(pattern for _, pattern in self.patterns),
+                         key=len, reverse=True)
+        super().__init__(b'|'.join(re.escape(pattern) for pattern in ordered),
+                         len(ordered[0]))
+
+        self.names = {}
+        for name, pattern in self.patterns:
+            self.names.setdefault(pattern, name)
+
+    def identify(self, data):
+        '''Returns name of the pattern that matches at the start of data
+        or None if none matches
+        '''
+
+        m = self.regex.match(data)
+        if m is None:
+            return None
+
+        return self.names[m.group()]
+
+
+# common file signatures (magic numbers)
+SIGNATURES = [('ZIP', b'PK\x03\x04'),
+              ('ELF', b'\x7fELF'),
+              ('PDF', b'%PDF-'),
+              ('JPEG', b'\xff\xd8\xff'),
+              ('PNG', b'\x89PNG\r\n\x1a\n'),
+              ('GIF', b'GIF87a'),
+              ('GIF', b'GIF89a'),
+              ('gzip', b'\x1f\x8b\x08'),
+              ('bzip2', b'BZh91AY&SY'),
+              ('xz', b'\xfd7zXZ\x00'),
+              ('7-Zip', b"7z\xbc\xaf'\x1c"),
+              ('RAR', b'Rar!\x1a\x07'),
+              ('MS-DOS/PE', b'MZ\x90\x00'),
+              ('Mach-O', b'\xcf\xfa\xed\xfe'),
+              ('OLE2', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),
+              ('SQLite', b'SQLite format 3\x00'),
+              ('RIFF', b'RIFF'),
+              ('Ogg', b'OggS'),
+              ('FLAC', b'fLaC'),
+              ('tar', b'ustar\x00'),
+              ('ISO 9660', b'CD001'),
+             ]
+
+
+def compile_hex_pattern(text):
+    '''compile hex search pattern
+    Bytes are written as two hex digits; '??' matches any byte and
+    a '?' in place of a single digit matches any nibble.
+    A trailing '~K' allows up to K mismatching bytes.
+    Spaces are ignored
+    Returns matcher
+    Raises ValueError for invalid pattern
+    '''
+
+    text = text.replace(' ', '').upper()
+    text, tilde, mismatches = text.partition('~')
+    if tilde:
+        try:
+            mismatches = int(mismatches)
+        except ValueError:
+            raise ValueError('Invalid number of mismatches') from None
+    else:
+        mismatches = 0
+
+    if not text:
+        raise ValueError('Empty byte string')
+
+    if len(text) & 1:
+        raise ValueError('Invalid byte string (uneven number of digits)')
+
+    values = bytearray()
+    masks = bytearray()
+    for x in range(0, len(text), 2):
+        value = mask = 0
+        for digit in text[x:x + 2]:
+            value <<= 4
+            mask <<= 4
+            if digit == '?':
+                continue
+            try:
+                value |= int(digit, 16)
+            except ValueError:
+                raise ValueError('Invalid value in byte string') from None
+            mask |= 0xf
+
+        values.append(value)
+        masks.append(mask)
+
+    if masks.count(0xff) == len(masks):
+        # no wildcards
+        if mismatches:
+            return ApproxMatcher(values, mismatches)
+        return LiteralMatcher(values)
+
+    if mismatches:
+        raise ValueError('Wildcards can not be combined with mismatches')
+
+    return HexPatternMatcher(values, masks)
+
+
+
+class ValueMatcher:
+    '''matches a typed value, or any value in a range
+    fmt is a struct format character for the type
+    The range is translated into the byte patterns of the values
+    it holds, so that chunks are scanned by re or bytes.find
+    rather than decoded and compared value by value
+    '''
+
+    # first window for backward searches; it doubles until a match is found
+    WINDOW = 256
+
+    def __init__(self, fmt, byteorder, low, high=None, align=1):
+        '''initialize
+        byteorder is '<' for little endian or '>' for big endian
+        Raises ValueError for invalid type, value or alignment
+        '''
+
+        if high is None:
+            high = low
+
+        try:
+            self.itemsize = struct.calcsize('<' + fmt)
+        except struct.error:
+            raise ValueError("Unsupported type '{}'".format(fmt)) from None
+
+        if align < 1 or (align % self.itemsize and self.itemsize % align):
+            raise ValueError('Invalid alignment')
+
+        if fmt in 'fd':
+            ranges = self.float_ranges(fmt, float(low), float(high))
+        else:
+            ranges = self.int_ranges(fmt, low, high)
+
+        self.maxlen = self.itemsize
+        self.align = align
+
+        # alternatives are sequences of byte ranges, most significant first
+        sequences = []
+        for lo, hi in ranges:
+            sequences.extend(byte_ranges(lo, hi, self.itemsize))
+        if byteorder == '<':
+            sequences = [seq[::-1] for seq in sequences]
+
+        pattern = b'|'.join(b''.join(byte_class(lo, hi) for lo, hi in seq)
+                            for seq in sequences)
+        self.regex = re.compile(pattern, re.DOTALL)
+
+        # a single value is searched for as a literal
+        self.literal = None
+        if len(sequences) == 1 and all(lo == hi for lo, hi in sequences[0]):
+            self.literal = bytes(lo for lo, _ in sequences[0])
+
+        # these only try offsets that are a multiple of align from
+        # the start; the first finds the first match, the second the last
+        if align == 1:
+            skip = b'.'
+        else:
+            skip = b'.{%d}' % align
+        self.first = re.compile(b'(?:%s)*?(%s)' % (skip, pattern), re.DOTALL)
+        self.last = re.compile(b'(?:%s)*(%s)' % (skip, pattern), re.DOTALL)
+
+    def int_ranges(self, fmt, low, high):
+        '''Returns list of tuples: (low, high) of unsigned integers
+        that hold the two's complement of the values in range
+        Raises ValueError if the range does not fit the type
+        '''
+
+        bits = self.itemsize * 8
+        if fmt.islower():
+            minimum, maximum = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+        else:
+            minimum, maximum = 0, (1 << bits) - 1
+
+        for value in (low, high):
+            if not minimum <= value <= maximum:
+                raise ValueError('Value {} out of range for type'.format(value))
+        if low > high:
+            raise ValueError('Invalid range')
+
+        ranges = []
+        if low < 0:
+            ranges.append((low + (1 << bits), min(high, -1) + (1 << bits)))
+        if high >= 0:
+            ranges.append((max(low, 0), high))
+        return ranges
+
+    def float_ranges(self, fmt, low, high):
+        '''Returns list of tuples: (low, high) of unsigned integers
+        that hold the bit patterns of the values in range
+        Positive floats sort like their bit patterns and negative
+        floats sort like their magnitudes, so that a float range
+        is at most two ranges of bit patterns
+        Raises ValueError if the range does not fit the type
+        '''
+
+        def bitpattern(value):
+            '''Returns bit pattern of float as unsigned integer'''
+
+            return int.from_bytes(struct.pack('>' + fmt, value), 'big')
+
+        for value in (low, high):
+            if math.isnan(value):
+                raise ValueError('Can not search for NaN')
+            try:
+                bitpattern(value)
+            except OverflowError:
+                raise ValueError('Value {} out of range for type'.format(value)) from None
+        if low > high:
+            raise ValueError('Invalid range')
+
+        sign = 1 << (self.itemsize * 8 - 1)
+        ranges = []
+        if low <= 0:
+            # magnitudes of the negative values, including -0.0
+            ranges.append((sign | bitpattern(-high if high < 0 else 0.0),
+                           sign | bitpattern(-low if low < 0 else 0.0)))
+        if high >= 0:
+            ranges.append((bitpattern(low if low > 0 else 0.0), bitpattern(high)))
+        return ranges
+
+    def find(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of first match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        if self.literal is not None:
+            idx = buf.find(self.literal, start, end)
+        else:
+            m = self.regex.search(buf, start, end)
+            idx = -1 if m is None else m.start()
+
+        if idx != -1 and (idx - start) % self.align:
+            # not aligned; only try aligned offsets from here on
+            idx += -(idx - start) % self.align
+            m = self.first.match(buf, idx, end)
+            idx = -1 if m is None else m.start(1)
+
+        if idx == -1:
+            return -1, 0
+
+        return idx, self.maxlen
+
+    def rfind(self, buf, start, stop, size):
+        '''Returns tuple: (index, length) of last match
+        or (-1, 0) if not found
+        '''
+
+        end = stop + self.maxlen - 1
+        if end > size:
+            end = size
+
+        if self.literal is not None:
+            idx = buf.rfind(self.literal, start, end)
+            if idx == -1:
+                return -1, 0
+            if (idx - start) % self.align == 0:
+                return idx, self.maxlen
+            # not aligned; look before it
+            end = idx + self.maxlen - 1
+
+        # search windows that grow towards start, so that
+        # the cost is in proportion to the distance of the match
+        window = ValueMatcher.WINDOW
+        while end - start >= self.maxlen:
+            low = end - self.maxlen + 1 - window
+            if low < start:
+                low = start
+
+            # the first match in the window, at any alignment
+            m = self.regex.search(buf, low, end)
+            if m is not None:
+                idx = m.start() + -(m.start() - start) % self.align
+                m = self.last.match(buf, idx, end)
+                if m is not None:
+                    return m.start(1), self.maxlen
+
+            if low == start:
+                break
+            end = low + self.maxlen - 1
+            window *= 2
+
+        return -1, 0
+
+
+
+def byte_ranges(low, high, nbytes):
+    '''Returns list of sequences of tuples: (low byte, high byte)
+    that together match the big endian unsigned integers
+    in the range low up to and including high
+    '''
+
+    if nbytes == 1:
+        return [[(low, high)]]
+
+    shift = (nbytes - 1) * 8
+    full = (1 << shift) - 1
+    low_top, low_rest = low >> shift, low & full
+    high_top, high_rest = high >> shift, high & full
+
+    if low_top == high_top:
+        return [[(low_top, low_top)] + seq
+                for seq in byte_ranges(low_rest, high_rest, nbytes - 1)]
+
+    head = []
+    if low_rest:
+        head = [[(low_top, low_top)] + seq
+                for seq in byte_ranges(low_rest, full, nbytes - 1)]
+        low_top += 1
+
+    tail = []
+    if high_rest != full:
+        tail = [[(high_top, high_top)] + seq
+                for seq in byte_ranges(0, high_rest, nbytes - 1)]
+        high_top -= 1
+
+    middle = []
+    if low_top <= high_top:
+        middle = [[(low_top, high_top)] + [(0, 0xff)] * (nbytes - 1)]
+
+    return head + middle + tail
+
+
+def byte_class(low, high):
+    '''Returns regex pattern that matches one byte in range'''
+
+    if low == high:
+        return re.escape(bytes([low]))
+
+    if low == 0 and high == 0xff:
+        return b'.'
+
+    return b'[' + re.escape(bytes([low])) + b'-' + re.escape(bytes([high])) + b']'
+
+
+
+# encodings for text searches
+TEXT_ENCODINGS = ('utf-8', 'utf-16le', 'utf-16be', 'utf-32le', 'utf-32be')
+
+
+def alternation(variants):
+    '''Returns regex pattern that matches any of the byte strings
+    Variants that differ in a single byte become a character class
+    '''
+
+    if len(variants) == 1:
+        return re.escape(variants[0])
+
+    first = variants[0]
+    if all(len(variant) == len(first) for variant in variants):
+        diffs = [i for i in range(len(first))
+                 if any(variant[i] != first[i] for variant in variants)]
+        if len(diffs) == 1:
+            i = diffs[0]
+            chars = b''.join(re.escape(variant[i:i + 1]) for variant in variants)
+            return (re.escape(first[:i]) + b'[' + chars + b']' +
+                    re.escape(first[i + 1:]))
+
+    return b'(?:' + b'|'.join(re.escape(variant) for variant in variants) + b')'
+
+
+def compile_text_pattern(text, encoding='utf-8', ignorecase=False):
+    '''compile text search pattern
+    Case folding is done by an alternation of the encoded upper and
+    lower case forms of each character, so that chunks never need
+    to be converted
+    Returns matcher
+    Raises ValueError for invalid pattern or encoding
+    '''
+
+    if not text:
+        raise ValueError('Empty search text')
+
+    if encoding not in TEXT_ENCODINGS:
+        raise ValueError("Unknown encoding '{}'".format(encoding))
+
+    try:
+        if not ignorecase:
+            return LiteralMatcher(text.encode(encoding))
+
+        pattern = []
+        maxlen = 0
+        folded = False
+        for ch in text:
+            variants = [ch.encode(encoding)]
+            for variant in (ch.lower(), ch.upper()):
+                if len(variant) == 1 and variant.encode(encoding) not in variants:
+                    variants.append(variant.encode(encoding))
+            maxlen += max(len(variant) for variant in variants)
+            if len(variants) > 1:
+                folded = True
+
+            pattern.append(alternation(variants))
+    except UnicodeEncodeError:
+        raise ValueError("Text can not be encoded as {}".format(encoding)) from None
+
+    if not folded:
+        # nothing to fold, like digits
+        return LiteralMatcher(text.encode(encoding))
+
+    return RegexMatcher(b''.join(pattern), maxlen)
+
+
+
+# value types for value searches
+VALUE_TYPES = {'int8': 'b', 'uint8': 'B',
+               'int16': 'h', 'uint16': 'H',
+               'int32': 'i', 'uint32': 'I',
+               'int64': 'q', 'uint64': 'Q',
+               'float': 'f', 'float32': 'f',
+               'double': 'd', 'float64': 'd'}
+
+VALUE_PATTERN = re.compile(r'\s*([A-Za-z]+\d*)'
+                           r'(?:\s+in\s*\[([^,\]]+),([^\]]+)\]|(?:\s*=\s*|\s+)([^\s,]+))'
+                           r'\s*(?:,?\s*align\s+(\d+))?\s*$')
+
+
+def compile_value_pattern(text, byteorder):
+    '''compile value search pattern
+    The pattern is 'TYPE = VALUE' or 'TYPE in [LOW, HIGH]', optionally
+    followed by 'align N'
+    Returns matcher
+    Raises ValueError for invalid pattern
+    '''
+
+    m = VALUE_PATTERN.match(text)
+    if m is None:
+        raise ValueError('Invalid value search')
+
+    typename, low, high, value, align = m.groups()
+    try:
+        fmt = VALUE_TYPES[typename.lower()]
+    except KeyError:
+        raise ValueError("Unknown type '{}'".format(typename)) from None
+
+    if value is not None:
+        low = high = value
+
+    values = []
+    for arg in (low, high):
+        arg = arg.strip()
+        try:
+            if fmt in 'fd':
+                values.append(float(arg))
+            else:
+                values.append(int(arg, 0))
+        except ValueError:
+            raise ValueError("Invalid value '{}'".format(arg)) from None
+
+    if align is None:
+        align = 1
+    return ValueMatcher(fmt, byteorder, values[0], values[1], int(align))
+
+
+
+class Scanner:
+    '''streams through a file looking for matches
+    The file is read with readinto() into a buffer that is reused
+    for every chunk; chunks overlap by the longest match length
+    '''
+
+    BUFSIZE = 4 * 1024 * 1024
+
+    def __init__(self, filename, bufsize=None):
+        '''initialize'''
+
+        self.filename = filename
+        if bufsize is None:
+            bufsize = Scanner.BUFSIZE
+        self.bufsize = bufsize
+        self.buf = None
+        # progress of the current scan, in bytes
+        self.scanned = 0
+        self.total = 0
+        # set to stop the current scan
+        self.cancelled = False
+
+    def getbuffer(self, size):
+        '''Returns buffer of at least size bytes
+        The buffer is kept for the next scan
+        '''
+
+        if self.buf is None or len(self.buf) < size:
+            self.buf = bytearray(size)
+
+        return self.buf
+
+    def close(self):
+        '''release resources'''
+
+        self.buf = None
+
+    def find(self, matcher, pos, end=-1):
+        '''Returns offset of first match at or after pos
+        or -1 if not found
+        '''
+
+        for offset, _ in self.finditer(matcher, pos, end):
+            return offset
+
+        return -1
+
+    def finditer(self, matcher, pos, end=-1, overlapped=True):
+        '''generate tuples: (offset, length) of matches
+        that start in the range pos up to end
+        If end is -1, search up to end of file
+        If not overlapped, the next match starts after the end
+        of the previous one
+        Raises OSError on I/O error
+        '''
+
+        self.scanned = 0
+
+        if pos < 0:
+            pos = 0
+        # file offset where the next match may start
+        nextpos = pos
+
+        overlap = matcher.maxlen - 1
+        buf = self.getbuffer(self.bufsize + overlap)
+        view = memoryview(buf)
+
+        with open(self.filename, 'rb', buffering=0) as f:
+            self.total = os.fstat(f.fileno()).st_size - pos
+            if end != -1 and end - pos < self.total:
+                self.total = end - pos
+            f.seek(pos, os.SEEK_SET)
+
+            # base is the file offset of buf[0]
+            base = pos
+            # number of bytes carried over from the previous chunk
+            carried = 0
+            eof = False
+            while not eof and not self.cancelled:
+                # do not read further than a match that starts before end
+                # can reach
+                limit = self.bufsize + overlap
+                if end != -1 and base + limit > end + overlap:
+                    limit = max(end + overlap - base, carried)
+                nbytes = f.readinto(view[carried:limit])
+                if not nbytes:
+                    eof = True
+                    nbytes = 0
+                size = carried + nbytes
+                self.scanned += nbytes
+
+                # matches must start before the overlap, unless this is
+                # the final chunk
+                if eof:
+                    stop = size
+                else:
+                    stop = size - overlap
+                    if stop < 0:
+                        stop = 0
+                if end != -1 and base + stop >= end:
+                    stop = max(end - base, 0)
+                    eof = True
+
+                idx = nextpos - base
+                if idx < 0:
+                    idx = 0
+                while True:
+                    # first offset that is aligned in the file
+                    idx += -(base + idx) % matcher.align
+                    if idx >= stop:
+                        break
+
+                    idx, length = matcher.find(buf, idx, stop, size)
+                    if idx == -1:
+                        break
+
+                    yield base + idx, length
+                    if overlapped or not length:
+                        idx += 1
+                    else:
+                        idx += length
+                    nextpos = base + idx
+
+                # move the overlap to the front of the buffer
+                carried = size - stop
+                if carried > overlap:
+                    carried = overlap
+                if carried:
+                    view[:carried] = view[size - carried:size]
+                base += size - carried
+
+    def rfind(self, matcher, pos):
+        '''Returns offset of last match that ends at or before pos
+        or -1 if not found
+        '''
+
+        for offset, _ in self.rfinditer(matcher, pos):
+            return offset
+
+        return -1
+
+    def rfinditer(self, matcher, pos):
+        '''generate tuples: (offset, length) of matches that end
+        at or before pos, in descending order
+        Raises OSError on I/O error
+        '''
+
+        self.scanned = 0
+        self.total = pos
+
+        overlap = matcher.maxlen - 1
+        buf = self.getbuffer(self.bufsize + overlap)
+        view = memoryview(buf)
+
+        with open(self.filename, 'rb', buffering=0) as f:
+            # the chunk covers the file from low up to high;
+            # matches must start before limit
+            high = limit = pos
+            while limit > 0 and not self.cancelled:
+                low = limit - self.bufsize
+                if low < 0:
+                    low = 0
+
+                f.seek(low, os.SEEK_SET)
+                size = 0
+                while size < high - low:
+                    nbytes = f.readinto(view[size:high - low])
+                    if not nbytes:
+                        break
+                    size += nbytes
+                self.scanned += limit - low
+
+                stop = limit - low
+                while stop > 0:
+                    idx, length = matcher.rfind(buf, -low % matcher.align,
+                                                stop, size)
+                    if idx == -1:
+                        break
+
+                    yield low + idx, length
+                    stop = idx
+
+                # the next chunk re-reads the overlap, so that matches
+                # across the boundary are found
+                limit = low
+                high = min(low + overlap, high)
+
+
+
+def scan_shard(filename, matcher, start, end, limit=0, overlapped=True):
+    '''scan one shard of a file; runs in a worker process
+    Returns list of tuples: (offset, length) of matches that start
+    in the range start up to end; at most limit matches if limit > 0
+    Raises OSError on I/O error
+    '''
+
+    matches = []
+    scanner = Scanner(filename)
+    for match in scanner.finditer(matcher, start, end, overlapped):
+        matches.append(match)
+        if len(matches) == limit:
+            break
+
+    return matches
+
+
+
+class ParallelScanner(Scanner):
+    '''scanner that splits forward scans into shards
+    Shards are scanned in a pool of worker processes that each open
+    the file by themselves; results are merged in offset order.
+    Backward scans are not sharded
+    '''
+
+    SHARDSIZE = 64 * 1024 * 1024
+
+    def __init__(self, filename, jobs, bufsize=None, shardsize=None):
+        '''initialize'''
+
+        super().__init__(filename, bufsize)
+
+        self.jobs = jobs
+        if shardsize is None:
+            shardsize = ParallelScanner.SHARDSIZE
+        self.shardsize = shardsize
+        self.pool = None
+
+    def getpool(self):
+        '''Returns process pool
+        The pool is started on first use
+        '''
+
+        if self.pool is None:
+            # do not fork; the parent runs threads
+            context = multiprocessing.get_context('spawn')
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.jobs,
+                                                               mp_context=context)
+            # shut down while the interpreter is still intact
+            atexit.register(self.close)
+        return self.pool
+
+    def close(self):
+        '''stop the worker processes'''
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+        super().close()
+
+    def find(self, matcher, pos, end=-1):
+        '''Returns offset of first match at or after pos
+        or -1 if not found
+        '''
+
+        for offset, _ in self.scan(matcher, pos, end, 1):
+            return offset
+
+        return -1
+
+    def finditer(self, matcher, pos, end=-1, overlapped=True):
+        '''generate tuples: (offset, length) of matches
+        that start in the range pos up to end
+        If end is -1, search up to end of file
+        If not overlapped, the next match starts after the end
+        of the previous one
+        Raises OSError on I/O error
+        '''
+
+        return self.scan(matcher, pos, end, 0, overlapped)
+
+    def scan(self, matcher, pos, end, limit, overlapped=True):
+        '''generate tuples: (offset, length) of matches, in order
+        Each shard reports at most limit matches if limit > 0
+        The matches of a shard are generated as soon as all shards
+        before it are done
+        Raises OSError on I/O error
+        '''
+
+        if pos < 0:
+            pos = 0
+
+        filesize = os.stat(self.filename).st_size
+        if end == -1 or end > filesize:
+            end = filesize
+
+        if end - pos <= self.shardsize:
+            # not worth the trouble
+            yield from super().finditer(matcher, pos, end, overlapped)
+            return
+
+        self.scanned = 0
+        self.total = end - pos
+
+        pool = self.getpool()
+        nextpos = pos
+        shards = iter(range(pos, end, self.shardsize))
+        # queue of tuples: (shard start, shard end, future)
+        pending = collections.deque()
+        try:
+            while not self.cancelled:
+                # keep the workers busy, but do not run far ahead
+                while len(pending) < 2 * self.jobs:
+                    start = next(shards, None)
+                    if start is None:
+                        break
+                    stop = min(start + self.shardsize, end)
+                    future = pool.submit(scan_shard, self.filename, matcher,
+                                         start, stop, limit, overlapped)
+                    pending.append((start, stop, future))
+
+                if not pending:
+                    break
+
+                start, stop, future = pending[0]
+                try:
+                    matches = future.result(timeout=0.1)
+                except concurrent.futures.TimeoutError:
+                    continue
+
+                pending.popleft()
+                self.scanned += stop - start
+                if not overlapped and matches and matches[0][0] < nextpos:
+                    # a match of the previous shard runs into this one
+                    matches = self.resync(matcher, nextpos, stop, matches)
+                for offset, length in matches:
+                    yield offset, length
+                    nextpos = offset + length
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+    def resync(self, matcher, pos, end, matches):
+        '''Returns matches of a shard that was scanned without overlap,
+        as they are when the scan starts at pos rather than at the start
+        of the shard. The shard is rescanned from pos up to the first
+        match that both scans agree on; from there on they are the same
+        '''
+
+        known = set(matches)
+        rescanned = []
+        scanner = Scanner(self.filename, self.bufsize)
+        for match in scanner.finditer(matcher, pos, end, overlapped=False):
+            if match in known:
+                return rescanned + matches[matches.index(match):]
+            rescanned.append(match)
+        return rescanned
+
+
+
+class MatchIndex:
+    '''sorted index of match offsets
+    key identifies the search that produced the matches
+    '''
+
+    def __init__(self, key=None):
+        '''initialize'''
+
+        self.key = key
+        self.offsets = array.array('Q')
+        # partial until the whole file has been searched; only
+        # complete indexes go into the result cache
+        self.complete = False
+
+    def __len__(self):
+        '''Returns number of matches'''
+
+        return len(self.offsets)
+
+    def add(self, offset):
+        '''add match offset
+        Offsets must be added in ascending order
+        '''
+
+        self.offsets.append(offset)
+
+    def next(self, pos):
+        '''Returns index of first match at or after pos
+        or -1 if there is none
+        '''
+
+        idx = bisect.bisect_left(self.offsets, pos)
+        if idx >= len(self.offsets):
+            return -1
+
+        return idx
+
+    def prev(self, pos):
+        '''Returns index of last match before pos
+        or -1 if there is none
+        '''
+
+        return bisect.bisect_left(self.offsets, pos) - 1
+
+    def find(self, offset):
+        '''Returns index of match at offset
+        or -1 if there is none
+        '''
+
+        idx = bisect.bisect_left(self.offsets, offset)
+        if idx < len(self.offsets) and self.offsets[idx] == offset:
+            return idx
+
+        return -1
+
+
+
+# longest string reported at once, in bytes; longer runs are split
+STRINGS_MAXLEN = 4096
+
+
+def strings_matcher(minlen):
+    '''Returns matcher for runs of printable ASCII or UTF-16LE
+    of at least minlen characters
+    Raises ValueError for invalid length
+    '''
+
+    if minlen < 1 or minlen > STRINGS_MAXLEN // 2:
+        raise ValueError('Invalid minimum string length')
+
+    printable = b'[\t\x20-\x7e]'
+    pattern = b'(?:%s\x00){%d,%d}|%s{%d,%d}' % (printable, minlen,
+                                                 STRINGS_MAXLEN // 2,
+                                                 printable, minlen,
+                                                 STRINGS_MAXLEN)
+    return RegexMatcher(pattern, STRINGS_MAXLEN)
+
+
+
+class StringsIndex:
+    '''compact index of strings in a file
+    Holds only offsets and lengths; the strings stay in the file
+    key identifies the scan that produced the index
+    '''
+
+    def __init__(self, key=None):
+        '''initialize'''
+
+        self.key = key
+        self.offsets = array.array('Q')
+        self.lengths = array.array('L')
+        # set when the scan got to the end of the file; a cancelled
+        # or still running scan leaves it unset
+        self.complete = False
+
+    def __len__(self):
+        '''Returns number of strings'''
+
+        # the scan thread adds the offset first
+        return len(self.lengths)
+
+    def add(self, offset, length):
+        '''add string'''
+
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+
+
+def file_identity(filename):
+    '''Returns tuple that identifies the file and its contents:
+    (path, device, inode, size, modification time)
+    Raises OSError on error
+    '''
+
+    path = os.path.realpath(filename)
+    st = os.stat(path)
+    return path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+
+class ResultCache:
+    '''LRU cache of search results, across sessions
+    Keys are tuples of strings, numbers and tuples, that start with
+    the file identity; a changed file gets new keys. Values are
+    offsets of single matches, or arrays of match offsets
+    If filename is given, the cache is loaded from and saved to disk
+    as JSON, so that a cache file can never run code
+    '''
+
+    MAXENTRIES = 64
+    # version of the file format
+    VERSION = 1
+
+    def __init__(self, filename=None, maxentries=None):
+        '''initialize'''
+
+        self.filename = filename
+        if maxentries is None:
+            maxentries = ResultCache.MAXENTRIES
+        self.maxentries = maxentries
+        self.entries = collections.OrderedDict()
+        self.dirty = False
+
+    def get(self, key):
+        '''Returns cached value, or None if not cached'''
+
+        try:
+            value = self.entries[key]
+        except KeyError:
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''store value in cache'''
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def load(self):
+        '''load cache from disk
+        A missing or unreadable cache file is ignored
+        '''
+
+        if self.filename is None:
+            return
+
+        def as_tuple(key):
+            '''Returns key with JSON lists turned back into tuples'''
+
+            if isinstance(key, list):
+                return tuple(as_tuple(x) for x in key)
+            return key
+
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data['version'] != ResultCache.VERSION:
+                return
+
+            entries = []
+            for key, value in data['entries'][-self.maxentries:]:
+                if isinstance(value, list):
+                    value = array.array('Q', value)
+                elif not isinstance(value, int) or value < -1:
+                    raise ValueError('invalid cache entry')
+                entries.append((as_tuple(key), value))
+        except (OSError, ValueError, TypeError, KeyError, OverflowError):
+            return
+
+        for key, value in entries:
+            self.entries[key] = value
+
+    def save(self):
+        '''save cache to disk
+        Raises OSError on error
+        '''
+
+        if self.filename is None or not self.dirty:
+            return
+
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        entries = []
+        for key, value in self.entries.items():
+            if isinstance(value, array.array):
+                value = value.tolist()
+            entries.append((key, value))
+        data = {'version': ResultCache.VERSION, 'entries': entries}
+
+        # write a new file, then move it in place
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmpfile, self.filename)
+        self.dirty = False
+
+
+
+class SearchJob:
+    '''runs a search in a background thread
+    func is called with the scanner as argument; the value it
+    returns is the result of the job
+    '''
+
+    def __init__(self, scanner, func):
+        '''initialize and start the job'''
+
+        self.scanner = scanner
+        self.func = func
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.done = threading.Event()
+
+        scanner.cancelled = False
+        scanner.scanned = scanner.total = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        '''thread main function
+        Any exception is kept in error; cancelling is not an exception,
+        so an error is never mistaken for a cancelled search
+        '''
+
+        try:
+            self.result = self.func(self.scanner)
+        except Exception as err:
+            self.error = err
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        '''wait for the job to finish
+        Returns True if finished
+        '''
+
+        return self.done.wait(timeout)
+
+    def cancel(self):
+        '''stop the job and wait for it to finish'''
+
+        self.scanner.cancelled = True
+        self.done.wait()
+
+    def cancelled(self):
+        '''Returns True if the job was cancelled'''
+
+        return self.scanner.cancelled
+
+    def progress(self):
+        '''Returns tuple: (bytes scanned, total bytes, bytes per second)'''
+
+        elapsed = time.monotonic() - self.started
+        scanned = self.scanner.scanned
+        if elapsed > 0:
+            rate = scanned / elapsed
+        else:
+            rate = 0.0
+        return scanned, self.scanner.total, rate
+
+# EOB
@@ -24,6 +24,7 @@
 '''classes and routines for text mode screens'''
 
 import curses
+import locale
 import os
 import re
 import sys
@@ -59,6 +60,10 @@ CURSES_COLORPAIR_IDX = 0
 WANT_COLORS = True
 # terminal can do color at all
 HAS_COLORS = False
+# draw into the screenbuf and only send changes to curses on commit
+RETAINED_MODE = True
+# write ANSI escape sequences to the terminal instead of using curses
+ANSI_OUTPUT = False
 
 LM_HLINE = 1
 LM_VLINE = 2
@@ -96,6 +101,15 @@ REGEX_HOTKEY = re.compile(r'.*<((Ctrl-)?[!-~])>.*$')
 # window stack
 STACK = None
 
+# highest character code; screenbuf values above this are
+# curses line drawing characters
+MAX_UNICODE = 0x10ffff
+# screenbuf characters as bytes
+if sys.byteorder == 'little':
+    TEXTBUF_ENCODING = 'utf-32-le'
+else:
+    TEXTBUF_ENCODING = 'utf-32-be'
+
 # debug messages
 DEBUG_LOG = []
 
@@ -568,6 +582,180 @@ class Video:
         self.color = video_color(WHITE, BLACK, bold=False)
         self.curses_color = curses_color(WHITE, BLACK, bold=False)
 
+        # in retained mode the screenbuf is a back buffer;
+        # frontbuf holds what curses has got, and dirty marks
+        # the rows that may differ between the two
+        # This needs the colorbuf, so it's for color screens only
+        self.retained = False
+        self.frontbuf = None
+        self.dirty = None
+        # pending scrolls of screen lines: (y, h, nlines)
+        self.scrolls = []
+        if RETAINED_MODE and HAS_COLORS:
+            self.set_retained()
+
+    def set_retained(self):
+        '''switch to retained mode'''
+
+        assert isinstance(self.screenbuf, ColorScreenBuf)
+
+        self.retained = True
+        self.frontbuf = ColorScreenBuf(self.w, self.h)
+        self.dirty = bytearray(self.h)
+        self.invalidate()
+
+    def invalidate(self):
+        '''forget what is on the curses screen
+        so that the next commit() sends everything
+        '''
+
+        if not self.retained:
+            return
+
+        # no character ever has this value
+        self.frontbuf.textbuf = array.array('I', [0xffffffff]) * (self.w * self.h)
+        self.dirty[:] = b'\x01' * self.h
+        self.scrolls = []
+
+    def damage(self, y, h=1):
+        '''mark rows as changed'''
+
+        h = min(h, self.h - y)
+        if h > 0:
+            self.dirty[y:y + h] = b'\x01' * h
+
+    def commit(self):
+        '''send changes in the back buffer to curses
+        Only runs of changed cells get written
+        '''
+
+        if not self.retained:
+            return
+
+        for y, h, nlines in self.scrolls:
+            self.scroll_lines(y, h, nlines)
+        self.scrolls = []
+
+        w = self.w
+        back = self.screenbuf
+        front = self.frontbuf
+        y = self.dirty.find(1)
+        while y != -1:
+            offset = w * y
+            text = back.textbuf[offset:offset + w]
+            colors = back.colorbuf[offset:offset + w]
+            old_text = front.textbuf[offset:offset + w]
+            old_colors = front.colorbuf[offset:offset + w]
+            if text != old_text or colors != old_colors:
+                self.commit_line(y, text, colors, old_text, old_colors)
+                front.textbuf[offset:offset + w] = text
+                front.colorbuf[offset:offset + w] = colors
+
+            self.dirty[y] = 0
+            y = self.dirty.find(1, y + 1)
+
+    def commit_line(self, y, text, colors, old_text, old_colors):
+        '''write the changed runs of a single line'''
+
+        w = self.w
+        x = 0
+        while x < w:
+            if text[x] == old_text[x] and colors[x] == old_colors[x]:
+                x += 1
+                continue
+
+            # collect a run of cells in the same color
+            # Unchanged cells in between are sent along, because
+            # one longer write is cheaper than many short ones
+            color = colors[x]
+            start = x
+            end = x = x + 1
+            while x < w and colors[x] == color:
+                if text[x] != old_text[x] or color != old_colors[x]:
+                    end = x + 1
+                x += 1
+
+            self.write_run(start, y, text[start:end], color)
+
+    def scroll(self, x, y, w, h, nlines):
+        '''scroll rectangle up by nlines; negative nlines scrolls down
+        The exposed lines keep their old contents;
+        the caller is expected to draw them
+        Returns False if the rectangle can not be scrolled,
+        the caller should redraw it instead
+        '''
+
+        if not self.retained:
+            return False
+
+        visible, x, y, w, h = self.rect.clip_rect(x, y, w, h)
+        if not visible or abs(nlines) >= h:
+            return False
+
+        if not nlines:
+            return True
+
+        if nlines > 0:
+            rows = range(y, y + h - nlines)
+        else:
+            rows = range(y + h - 1, y - nlines - 1, -1)
+        for j in rows:
+            self.screenbuf.memmove(j * self.w + x, (j + nlines) * self.w + x, w)
+        self.damage(y, h)
+
+        # the terminal scrolls whole lines; commit() will
+        # repair whatever is next to the rectangle
+        self.scrolls.append((y, h, nlines))
+        return True
+
+    def scroll_lines(self, y, h, nlines):
+        '''scroll the screen lines y up to y + h by nlines'''
+
+        STDSCR.setscrreg(y, y + h - 1)
+        STDSCR.scrollok(True)
+        STDSCR.scroll(nlines)
+        STDSCR.scrollok(False)
+        STDSCR.setscrreg(0, self.h - 1)
+
+        self.scroll_frontbuf(y, h, nlines)
+
+    def scroll_frontbuf(self, y, h, nlines):
+        '''scroll the front buffer along with the screen'''
+
+        w = self.w
+        if nlines > 0:
+            self.frontbuf.memmove(y * w, (y + nlines) * w, (h - nlines) * w)
+            exposed = y + h - nlines
+        else:
+            nlines = -nlines
+            self.frontbuf.memmove((y + nlines) * w, y * w, (h - nlines) * w)
+            exposed = y
+
+        # the exposed lines are blank on screen
+        offset = exposed * w
+        self.frontbuf.textbuf[offset:offset + nlines * w] = array.array('I', [0xffffffff]) * (nlines * w)
+
+    def write_run(self, x, y, text, color):
+        '''write run of characters in a single color to curses'''
+
+        attr = curses_color(color)
+        if max(text) <= MAX_UNICODE:
+            self.curses_puts(x, y, textbuf_str(text), attr)
+            return
+
+        # line drawing characters carry curses attributes,
+        # they must be put one by one
+        start = 0
+        for i, ch in enumerate(text):
+            if ch > MAX_UNICODE:
+                if i > start:
+                    self.curses_puts(x + start, y, textbuf_str(text[start:i]), attr)
+                self.curses_putch(x + i, y, ch, attr)
+                start = i + 1
+
+        if start < len(text):
+            self.curses_puts(x + start, y, textbuf_str(text[start:]), attr)
+
     def set_color(self, fg, bg=None, bold=True, alt=False):
         '''set current color
         Returns the combined color code
@@ -591,6 +779,10 @@ class Video:
             attr = curses_color(color, alt=alt)
 
         self.screenbuf[x, y] = (ch, color)
+        if self.retained:
+            self.dirty[y] = 1
+            return
+
         self.curses_putch(x, y, ch, attr)
 
     def puts(self, x, y, msg, color=-1, alt=False):
@@ -618,6 +810,10 @@ class Video:
             attr = curses_color(color, alt=alt)
 
         self.screenbuf.puts(cx, cy, msg, color)
+        if self.retained:
+            self.dirty[cy] = 1
+            return
+
         self.curses_puts(cx, cy, msg, attr)
 
     def curses_putch(self, x, y, ch, attr=None, alt=False):
@@ -672,6 +868,10 @@ class Video:
             attr = curses_color(color, alt=alt)
 
         self.screenbuf.hline(x, y, w, ch, color)
+        if self.retained:
+            self.dirty[y] = 1
+            return
+
         if isinstance(ch, str):
             ch = ord(ch)
         STDSCR.hline(y, x, ch, w, attr)
@@ -690,6 +890,10 @@ class Video:
             attr = curses_color(color, alt=alt)
 
         self.screenbuf.vline(x, y, h, ch, color)
+        if self.retained:
+            self.damage(y, h)
+            return
+
         if isinstance(ch, str):
             ch = ord(ch)
         STDSCR.vline(y, x, ch, h, attr)
@@ -723,6 +927,12 @@ class Video:
         else:
             attr = curses_color(color, alt=alt)
 
+        if self.retained:
+            for j in range(0, h):
+                self.screenbuf.hline(x, y + j, w, ' ', color)
+            self.damage(y, h)
+            return
+
         for j in range(0, h):
             self.screenbuf.hline(x, y + j, w, ' ', color)
             STDSCR.hline(y + j, x, ' ', w, attr)
@@ -743,44 +953,55 @@ class Video:
         # top
         if 0 <= y < self.h:
             self.screenbuf.hline(cx, y, cw, curses.ACS_HLINE, color)
-            STDSCR.hline(y, cx, curses.ACS_HLINE, cw, attr)
+            if not self.retained:
+                STDSCR.hline(y, cx, curses.ACS_HLINE, cw, attr)
 
         # left
         if 0 <= x < self.w:
             self.screenbuf.vline(x, cy, ch, curses.ACS_VLINE, color)
-            STDSCR.vline(cy, x, curses.ACS_VLINE, ch, attr)
+            if not self.retained:
+                STDSCR.vline(cy, x, curses.ACS_VLINE, ch, attr)
 
         # right
         rx = x + w - 1
         if 0 <= rx < self.w:
             self.screenbuf.vline(rx, cy, ch, curses.ACS_VLINE, color)
-            STDSCR.vline(cy, rx, curses.ACS_VLINE, ch, attr)
+            if not self.retained:
+                STDSCR.vline(cy, rx, curses.ACS_VLINE, ch, attr)
 
         # bottom
         by = y + h - 1
         if 0 <= by < self.h:
             self.screenbuf.hline(cx, by, cw, curses.ACS_HLINE, color)
-            STDSCR.hline(by, cx, curses.ACS_HLINE, cw, attr)
+            if not self.retained:
+                STDSCR.hline(by, cx, curses.ACS_HLINE, cw, attr)
 
         # top left corner
         if self.rect.clip_point(x, y):
             self.screenbuf[x, y] = (curses.ACS_ULCORNER, color)
-            self.curses_putch(x, y, curses.ACS_ULCORNER, attr)
+            if not self.retained:
+                self.curses_putch(x, y, curses.ACS_ULCORNER, attr)
 
         # bottom left corner
         if self.rect.clip_point(x, by):
             self.screenbuf[x, by] = (curses.ACS_LLCORNER, color)
-            self.curses_putch(x, by, curses.ACS_LLCORNER, attr)
+            if not self.retained:
+                self.curses_putch(x, by, curses.ACS_LLCORNER, attr)
 
         # top right corner
         if self.rect.clip_point(rx, y):
             self.screenbuf[rx, y] = (curses.ACS_URCORNER, color)
-            self.curses_putch(rx, y, curses.ACS_URCORNER, attr)
+            if not self.retained:
+                self.curses_putch(rx, y, curses.ACS_URCORNER, attr)
 
         # bottom right corner
         if self.rect.clip_point(rx, by):
             self.screenbuf[rx, by] = (curses.ACS_LRCORNER, color)
-            self.curses_putch(rx, by, curses.ACS_LRCORNER, attr)
+            if not self.retained:
+                self.curses_putch(rx, by, curses.ACS_LRCORNER, attr)
+
+        if self.retained:
+            self.damage(cy, ch)
 
     def color_putch(self, x, y, color=-1, alt=False):
         '''put color at x, y'''
@@ -796,6 +1017,11 @@ class Video:
 
         # get the character and redraw with color
         offset = self.w * y + x
+        if self.retained:
+            self.screenbuf.colorbuf[offset] = color
+            self.dirty[y] = 1
+            return
+
         ch, _ = self.screenbuf[offset]
         self.screenbuf[offset] = (ch, color)
         if isinstance(ch, str):
@@ -815,8 +1041,13 @@ class Video:
         else:
             attr = curses_color(color, alt=alt)
 
-        # get the character and redraw with color
         offset = self.w * y + x
+        if self.retained:
+            self.screenbuf.colorbuf[offset:offset + w] = bytes([color]) * w
+            self.dirty[y] = 1
+            return
+
+        # get the character and redraw with color
         for i in range(0, w):
             ch, _ = self.screenbuf[offset]
             self.screenbuf[offset] = (ch, color)
@@ -838,8 +1069,15 @@ class Video:
         else:
             attr = curses_color(color, alt=alt)
 
-        # get the character and redraw with color
         offset = self.w * y + x
+        if self.retained:
+            for j in range(0, h):
+                self.screenbuf.colorbuf[offset] = color
+                offset += self.w
+            self.damage(y, h)
+            return
+
+        # get the character and redraw with color
         for j in range(0, h):
             ch, _ = self.screenbuf[offset]
             self.screenbuf[offset] = (ch, color)
@@ -881,6 +1119,10 @@ class Video:
             return
 
         self.screenbuf.copyrect(x, y, buf, 0, 0, buf.w, buf.h)
+        if self.retained:
+            self.damage(y, buf.h)
+            return
+
         # update the curses screen
         prev_color = None
         offset = self.w * y + x
@@ -906,6 +1148,178 @@ class Video:
 
 
 
+class AnsiVideo(Video):
+    '''text mode video that writes ANSI escape sequences
+    to the terminal by itself
+    curses is still used for setting up the terminal and
+    for keyboard input, but it never gets to draw anything
+    '''
+
+    # our color codes in ANSI order
+    ANSI_COLORS = (0, 4, 2, 6, 1, 5, 3, 7)
+    # DEC special graphics character set on/off
+    GRAPHICS_ON = '\x1b(0'
+    GRAPHICS_OFF = '\x1b(B'
+
+    def __init__(self):
+        '''initialize'''
+
+        super().__init__()
+
+        self.fd = sys.stdout.fileno()
+        self.encoding = locale.getpreferredencoding() or 'utf-8'
+        self.out = []
+        # where the terminal cursor is, and what color is set
+        # None means we don't know
+        self.cursor = None
+        self.sgr = None
+        self.sgr_codes = {}
+
+        if not self.retained:
+            self.set_retained()
+
+    @staticmethod
+    def sgr_code(old, color):
+        '''Returns ANSI escape sequence that changes color old
+        into combined color code color
+        If old is None, all attributes are set
+        '''
+
+        if old is None:
+            changed = 0xff
+        else:
+            changed = old ^ color
+
+        params = []
+        if changed & BOLD:
+            if color & BOLD:
+                params.append('1')
+            else:
+                params.append('22')
+        if changed & 7:
+            params.append('3{}'.format(AnsiVideo.ANSI_COLORS[color & 7]))
+        if changed & 0x70:
+            params.append('4{}'.format(AnsiVideo.ANSI_COLORS[(color >> 4) & 7]))
+        return '\x1b[{}m'.format(';'.join(params))
+
+    def invalidate(self):
+        '''forget what is on the terminal'''
+
+        super().invalidate()
+        self.cursor = None
+        self.sgr = None
+
+    def commit(self):
+        '''write changes in the back buffer to the terminal
+        Output is collected and written in one go
+        '''
+
+        super().commit()
+        if not self.out:
+            return
+
+        # park the cursor where curses thinks it is
+        self.move_cursor(self.w - 1, self.h - 1)
+
+        data = ''.join(self.out).encode(self.encoding, 'replace')
+        self.out = []
+
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def scroll_lines(self, y, h, nlines):
+        '''scroll the screen lines y up to y + h by nlines'''
+
+        # set scroll region, and line feed or reverse index
+        # at its edge. Setting the region homes the cursor
+        self.out.append('\x1b[{};{}r'.format(y + 1, y + h))
+        if nlines > 0:
+            self.out.append('\x1b[{}H'.format(y + h))
+            self.out.append('\n' * nlines)
+        else:
+            self.out.append('\x1b[{}H'.format(y + 1))
+            self.out.append('\x1bM' * -nlines)
+        self.out.append('\x1b[r')
+        self.cursor = None
+
+        self.scroll_frontbuf(y, h, nlines)
+
+    def move_cursor(self, x, y):
+        '''output the shortest cursor motion to x, y'''
+
+        if self.cursor is not None:
+            cx, cy = self.cursor
+            if cy == y:
+                if cx == x:
+                    return
+
+                if cx < x:
+                    n = x - cx
+                    if n == 1:
+                        self.out.append('\x1b[C')
+                    else:
+                        self.out.append('\x1b[{}C'.format(n))
+                    self.cursor = (x, y)
+                    return
+
+            elif x == 0 and cy + 1 == y:
+                self.out.append('\r\n')
+                self.cursor = (x, y)
+                return
+
+        if x == 0:
+            self.out.append('\x1b[{}H'.format(y + 1))
+        else:
+            self.out.append('\x1b[{};{}H'.format(y + 1, x + 1))
+        self.cursor = (x, y)
+
+    def write_run(self, x, y, text, color):
+        '''write run of characters in a single color to the terminal'''
+
+        self.move_cursor(x, y)
+
+        if color != self.sgr:
+            key = (self.sgr, color)
+            if key not in self.sgr_codes:
+                self.sgr_codes[key] = AnsiVideo.sgr_code(self.sgr, color)
+            self.out.append(self.sgr_codes[key])
+            self.sgr = color
+
+        if max(text) <= MAX_UNICODE:
+            self.out.append(textbuf_str(text))
+        else:
+            # line drawing characters are ACS values: characters
+            # from the DEC special graphics set, plus curses attributes
+            graphics = False
+            for ch in text:
+                if ch > MAX_UNICODE:
+                    if not graphics:
+                        self.out.append(AnsiVideo.GRAPHICS_ON)
+                        graphics = True
+                    self.out.append(chr(ch & 0xff))
+                else:
+                    if graphics:
+                        self.out.append(AnsiVideo.GRAPHICS_OFF)
+                        graphics = False
+                    if ch == 0:
+                        self.out.append(' ')
+                    else:
+                        self.out.append(chr(ch))
+
+            if graphics:
+                self.out.append(AnsiVideo.GRAPHICS_OFF)
+
+        x += len(text)
+        if x >= self.w:
+            # the terminal may or may not have wrapped
+            self.cursor = None
+        else:
+            self.cursor = (x, y)
+
+
+
 class ColorSet:
     '''collection of colors'''
 
@@ -933,6 +1347,7 @@ class ColorSet:
 
         self.prompt = self.text
         self.invisibles = self.text
+        self.highlight = self.cursor
 
 
 
@@ -1740,12 +2155,14 @@ class Button(Widget):
         # animate button
         self.pushing = True
         self.draw()
+        VIDEO.commit()
         STDSCR.refresh()
         curses.doupdate()
         time.sleep(0.1)
 
         self.pushing = False
         self.draw()
+        VIDEO.commit()
         STDSCR.refresh()
         curses.doupdate()
         time.sleep(0.1)
@@ -2128,6 +2545,7 @@ class Menu(Window):
                     self.cursor = y
                     self.draw_cursor()
                     # give visual feedback
+                    VIDEO.commit()
                     STDSCR.refresh()
                     curses.doupdate()
                     time.sleep(0.1)
@@ -2321,6 +2739,7 @@ class MenuBar(Window):
                     self.cursor = x
                     self.draw_cursor()
                     # give visual feedback
+                    VIDEO.commit()
                     STDSCR.refresh()
                     curses.doupdate()
                     time.sleep(0.1)
@@ -2675,6 +3094,26 @@ class WindowStack:
 
 
 
+def new_video():
+    '''Returns new Video instance for the selected output'''
+
+    if STDSCR is None:
+        init_curses()
+
+    if ANSI_OUTPUT and HAS_COLORS:
+        return AnsiVideo()
+
+    return Video()
+
+
+def textbuf_str(text):
+    '''Returns string for array of screenbuf characters'''
+
+    # characters are stored as unsigned ints, which
+    # happens to be what UTF-32 is
+    return text.tobytes().decode(TEXTBUF_ENCODING, 'replace').replace('\x00', ' ')
+
+
 def video_color(fg, bg=None, bold=False):
     '''Returns combined (ScreenBuf) color code'''
 
@@ -2961,6 +3400,7 @@ def terminate():
 def redraw_screen():
     '''redraw the entire screen'''
 
+    VIDEO.invalidate()
     VIDEO.clear_screen()
 
     for win in STACK.stack:
@@ -2970,6 +3410,7 @@ def redraw_screen():
         win.draw()
         win.draw_cursor()
 
+    VIDEO.commit()
     STDSCR.refresh()
     curses.doupdate()
 
@@ -2979,8 +3420,12 @@ def resize_event():
 
     global VIDEO
 
+    # curses clears the screen after a resize; let it do so now,
+    # rather than over the top of whatever gets drawn next
+    STDSCR.refresh()
+
     # start over
-    VIDEO = Video()
+    VIDEO = new_video()
     VIDEO.clear_screen()
 
     for win in STACK.stack:
@@ -2996,11 +3441,15 @@ def resize_event():
     redraw_screen()
 
 
-def getch():
+def getch(timeout=-1):
     '''get keyboard input
-    Returns key as a string value
+    If timeout (in milliseconds) is given, wait at most that long
+    Returns key as a string value, or None on timeout
     '''
 
+    # send the changes made since the last frame
+    VIDEO.commit()
+
     # move cursor to bottom right corner
     STDSCR.move(VIDEO.h - 1, VIDEO.w - 1)
 #    STDSCR.leaveok(0)      # leaveok() doesn't work; broken?
@@ -3008,26 +3457,37 @@ def getch():
     # update the screen
     curses.doupdate()
 
-    while True:
-        key = STDSCR.getch()
+    if timeout >= 0:
+        STDSCR.timeout(timeout)
 
-        ## DEBUG
-        if key == 17:
-            # Ctrl-Q is hardwired to bail out
-            terminate()
-            sys.exit(0)
+    try:
+        while True:
+            key = STDSCR.getch()
 
-        elif key == 18:
-            # Ctrl-R redraws the screen
-            redraw_screen()
+            if key == -1:
+                # timed out
+                return None
 
-        elif key == curses.KEY_RESIZE:
-            # terminal was resized
-            resize_event()
+            ## DEBUG
+            if key == 17:
+                # Ctrl-Q is hardwired to bail out
+                terminate()
+                sys.exit(0)
 
-        else:
-            # got a user key
-            break
+            elif key == 18:
+                # Ctrl-R redraws the screen
+                redraw_screen()
+
+            elif key == curses.KEY_RESIZE:
+                # terminal was resized
+                resize_event()
+
+            else:
+                # got a user key
+                break
+    finally:
+        if timeout >= 0:
+            STDSCR.timeout(-1)
 
     if ord(' ') <= key <= ord('~'):
         # ascii keys are returned as string
@@ -3049,7 +3509,7 @@ def init():
 
     global VIDEO, STACK
 
-    VIDEO = Video()
+    VIDEO = new_video()
     STACK = WindowStack()
 
 
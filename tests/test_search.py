@@ -0,0 +1,519 @@
+#
+#   test_search.py
+#
+#   Copyright 2016 by Walter de Jong <walter@heiho.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''tests of the search engines
+Every matcher is compared against a brute force search,
+in a single buffer and in a file that is scanned in small chunks
+'''
+
+import os
+import re
+import array
+import random
+import struct
+import functools
+import tempfile
+import unittest
+
+from hexviewlib import search
+
+
+# chunk sizes; small sizes put many matches across chunk boundaries
+BUFSIZES = (1, 2, 3, 7, 16, 4096)
+
+
+def random_data(size, alphabet, seed):
+    '''Returns bytes of random choices from alphabet'''
+
+    rand = random.Random(seed)
+    return bytes(rand.choice(alphabet) for _ in range(size))
+
+
+def brute_literal(data, pattern):
+    '''Returns list of tuples: (offset, length) of all matches'''
+
+    return [(i, len(pattern)) for i in range(len(data))
+            if data.startswith(pattern, i)]
+
+def brute_masked(data, values, masks):
+    '''Returns list of tuples: (offset, length) of all matches
+    of a pattern with wildcards
+    '''
+
+    n = len(values)
+    return [(i, n) for i in range(len(data) - n + 1)
+            if all(data[i + j] & masks[j] == values[j] for j in range(n))]
+
+def brute_approx(data, pattern, k):
+    '''Returns list of tuples: (offset, length) of all matches
+    with at most k mismatches
+    '''
+
+    n = len(pattern)
+    return [(i, n) for i in range(len(data) - n + 1)
+            if sum(a != b for a, b in zip(pattern, data[i:i + n])) <= k]
+
+def brute_regex(data, pattern):
+    '''Returns list of tuples: (offset, length) of all matches
+    that start at every offset
+    '''
+
+    regex = re.compile(pattern, re.DOTALL)
+    matches = []
+    for i in range(len(data)):
+        m = regex.match(data, i)
+        if m is not None and m.end() > m.start():
+            matches.append((i, m.end() - m.start()))
+    return matches
+
+
+def brute_value(data, fmt, low, high, align):
+    '''Returns list of tuples: (offset, length) of all values
+    in range at offsets that are a multiple of align
+    '''
+
+    size = struct.calcsize(fmt)
+    return [(i, size) for i in range(0, len(data) - size + 1, align)
+            if low <= struct.unpack_from(fmt, data, i)[0] <= high]
+
+
+def brute_multi(data, patterns):
+    '''Returns list of tuples: (offset, longest length) of matches
+    of any of the patterns
+    '''
+
+    matches = []
+    for i in range(len(data)):
+        lengths = [len(pattern) for _, pattern in patterns
+                   if data.startswith(pattern, i)]
+        if lengths:
+            matches.append((i, max(lengths)))
+    return matches
+
+
+
+class MatcherTest(unittest.TestCase):
+    '''compare matchers against brute force'''
+
+    def setUp(self):
+        '''initialize'''
+
+        self.tmpfile = None
+
+    def tearDown(self):
+        '''remove the temporary file'''
+
+        if self.tmpfile is not None:
+            os.unlink(self.tmpfile)
+
+    def write_file(self, data):
+        '''Returns name of temporary file holding data'''
+
+        if self.tmpfile is not None:
+            os.unlink(self.tmpfile)
+        fd, self.tmpfile = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self.tmpfile
+
+    def check(self, matcher, data, brute):
+        '''compare all ways of searching against brute force
+        brute(data) returns list of tuples: (offset, length) of all
+        matches in data, in order
+        '''
+
+        expected = brute(data)
+        offsets = [offset for offset, _ in expected]
+        size = len(data)
+
+        # forward, in a single buffer
+        found = []
+        idx = 0
+        while idx < size:
+            idx, _ = matcher.find(data, idx, size, size)
+            if idx == -1:
+                break
+            found.append(idx)
+            idx += matcher.align
+        self.assertEqual(found, offsets)
+
+        # backward, in a single buffer
+        found = []
+        stop = size
+        while stop > 0:
+            idx, _ = matcher.rfind(data, 0, stop, size)
+            if idx == -1:
+                break
+            found.append(idx)
+            stop = idx
+        self.assertEqual(found, offsets[::-1])
+
+        # in a file, in chunks
+        filename = self.write_file(data)
+        rand = random.Random(size)
+        for bufsize in BUFSIZES:
+            scanner = search.Scanner(filename, bufsize)
+            self.assertEqual(list(scanner.finditer(matcher, 0)), expected)
+
+            for _ in range(4):
+                pos = rand.randrange(size + 1)
+                end = rand.randrange(pos, size + 2)
+                self.assertEqual(list(scanner.finditer(matcher, pos, end)),
+                                 [(offset, length) for offset, length in expected
+                                  if pos <= offset < end])
+
+                # only the data before pos is seen; a shorter match
+                # may end there
+                self.assertEqual(list(scanner.rfinditer(matcher, pos)),
+                                 brute(data[:pos])[::-1])
+
+            self.assertEqual(list(scanner.rfinditer(matcher, size)),
+                             expected[::-1])
+
+    def test_literal(self):
+        '''literal byte strings'''
+
+        data = random_data(300, b'ab', 1)
+        for pattern in (b'a', b'ab', b'abba', b'aaaaa', b'bbbbbbbbbbbbbbbbbbbb'):
+            self.check(search.LiteralMatcher(pattern), data,
+                       functools.partial(brute_literal, pattern=pattern))
+
+    def test_hex_pattern(self):
+        '''hex patterns with wildcards'''
+
+        data = random_data(300, b'\x01\x12\x21\x22\xff', 2)
+        for text in ('12 ?? 21', '1? 22', '?1 ?2', '?? 22 ??', '12 2? ff ?1'):
+            matcher = search.compile_hex_pattern(text)
+            self.assertIsInstance(matcher, search.HexPatternMatcher)
+            self.check(matcher, data,
+                       functools.partial(brute_masked, values=matcher.values,
+                                         masks=matcher.masks))
+
+    def test_hex_pattern_short(self):
+        '''buffers shorter than the pattern hold no match'''
+
+        for text in ('12 ?? ?? ?? ?? ?? 34', '12 ?? ?? ??', '?2 ?? 12'):
+            matcher = search.compile_hex_pattern(text)
+            for size in range(matcher.maxlen):
+                data = b'\x12' * size
+                self.assertEqual(matcher.find(data, 0, size, size), (-1, 0))
+                self.assertEqual(matcher.rfind(data, 0, size, size), (-1, 0))
+
+        # the scanner reuses its buffer; stale bytes past the end
+        # of the file must not match
+        data = b'\x12' * 2000
+        filename = self.write_file(data)
+        scanner = search.Scanner(filename)
+        matcher = search.compile_hex_pattern('12 ?? ?? ?? ??')
+        self.assertEqual(list(scanner.finditer(matcher, 0)),
+                         brute_masked(data, matcher.values, matcher.masks))
+        self.assertEqual(list(scanner.finditer(matcher, 1997)), [])
+
+    def test_approx(self):
+        '''byte strings with mismatches'''
+
+        data = random_data(300, b'ab', 3)
+        for pattern, k in ((b'abab', 1), (b'aaaa', 2), (b'ab', 1),
+                           (b'abbabba', 3)):
+            self.check(search.ApproxMatcher(pattern, k), data,
+                       functools.partial(brute_approx, pattern=pattern, k=k))
+
+        with self.assertRaises(ValueError):
+            search.ApproxMatcher(b'ab', 2)
+
+        # no match fits in a short buffer, or past the end of the file
+        matcher = search.compile_hex_pattern('12 34 56 78 9A BC ~2')
+        for size in range(matcher.maxlen):
+            data = b'\x12\x34\x56\x78\x9a'[:size]
+            self.assertEqual(matcher.find(data, 0, size, size), (-1, 0))
+            self.assertEqual(matcher.rfind(data, 0, size, size), (-1, 0))
+
+        data = b'\x12\x34\x56\x78' * 500
+        filename = self.write_file(data)
+        scanner = search.Scanner(filename)
+        self.assertEqual(list(scanner.finditer(matcher, 1997)), [])
+        self.assertEqual(list(scanner.finditer(matcher, 0)),
+                         brute_approx(data, matcher.pattern, matcher.k))
+
+    def test_regex(self):
+        '''regular expressions of bounded length'''
+
+        data = random_data(300, b'abcd', 4)
+        for pattern in (b'a[bc]{1,3}d', b'ab|ba', b'(?:ab)+', b'd.a'):
+            self.check(search.RegexMatcher(pattern, 8), data,
+                       functools.partial(brute_regex, pattern=pattern))
+
+    def test_regex_empty(self):
+        '''patterns that match the empty string are rejected'''
+
+        for pattern in (b'a*', b'x?', b'|a', b'(?:)'):
+            with self.assertRaises(ValueError):
+                search.RegexMatcher(pattern)
+
+        # zero-length matches are skipped
+        matcher = search.RegexMatcher(b'(?=a)')
+        self.assertEqual(matcher.find(b'aaa', 0, 3, 3), (-1, 0))
+
+    def test_regex_not_overlapped(self):
+        '''matches do not overlap, like with re.finditer()'''
+
+        data = random_data(300, b'ab', 5)
+        filename = self.write_file(data)
+        matcher = search.RegexMatcher(b'a+', 300)
+        expected = [(m.start(), m.end() - m.start())
+                    for m in re.finditer(b'a+', data)]
+        for bufsize in BUFSIZES:
+            scanner = search.Scanner(filename, bufsize)
+            self.assertEqual(list(scanner.finditer(matcher, 0,
+                                                   overlapped=False)),
+                             expected)
+
+    def test_text_ignorecase(self):
+        '''text that is matched without regard to case'''
+
+        data = random_data(300, b'aAbB', 6)
+        matcher = search.compile_text_pattern('aB', ignorecase=True)
+        self.assertIsInstance(matcher, search.RegexMatcher)
+        self.check(matcher, data,
+                   functools.partial(brute_regex, pattern=b'(?i)ab'))
+
+        # nothing to fold
+        matcher = search.compile_text_pattern('12', ignorecase=True)
+        self.assertIsInstance(matcher, search.LiteralMatcher)
+
+    def test_multi(self):
+        '''several byte strings at once'''
+
+        data = random_data(300, b'abc', 7)
+        patterns = [('one', b'ab'), ('two', b'abc'), ('three', b'ca')]
+        matcher = search.MultiMatcher(patterns)
+        self.check(matcher, data,
+                   functools.partial(brute_multi, patterns=patterns))
+
+        self.assertEqual(matcher.identify(b'abcd'), 'two')
+        self.assertIsNone(matcher.identify(b'bb'))
+
+    def test_value(self):
+        '''typed values and ranges, in both byte orders'''
+
+        data = random_data(400, b'\x00\x01\x05\x3f\x80\xf0\xff', 8)
+        cases = (('uint8', 5, 5), ('int8', -16, 5), ('uint16', 0, 0x3f),
+                 ('int16', -200, 300), ('uint32', 0, 0x05000000),
+                 ('int32', -1, -1), ('int64', -2 ** 40, 2 ** 40),
+                 ('uint64', 0x0100000000000000, 0xf000000000000000),
+                 ('float', -1.0, 2.0), ('double', 0.0, 0.0),
+                 ('double', -1e300, -1e-300))
+        for typename, low, high in cases:
+            fmt = search.VALUE_TYPES[typename]
+            itemsize = struct.calcsize(fmt)
+            for byteorder in '<>':
+                for align in sorted(set((1, 2, itemsize, 8))):
+                    if align % itemsize and itemsize % align:
+                        continue
+                    matcher = search.ValueMatcher(fmt, byteorder, low, high,
+                                                  align)
+                    self.check(matcher, data,
+                               functools.partial(brute_value,
+                                                 fmt=byteorder + fmt,
+                                                 low=low, high=high,
+                                                 align=align))
+
+    def test_value_zero(self):
+        '''negative zero equals zero'''
+
+        data = struct.pack('<3f', 1.0, -0.0, 0.0)
+        matcher = search.compile_value_pattern('float = 0 align 4', '<')
+        self.check(matcher, data,
+                   functools.partial(brute_value, fmt='<f', low=0.0, high=0.0,
+                                     align=4))
+
+    def test_value_pattern(self):
+        '''parsing of value searches'''
+
+        matcher = search.compile_value_pattern('uint32 = 0xDEADBEEF', '<')
+        self.assertEqual(matcher.find(b'\x00\xef\xbe\xad\xde', 0, 5, 5),
+                         (1, 4))
+
+        # the aligned values are 255 and -256; the match at 1 is not aligned
+        matcher = search.compile_value_pattern('int16 in [-2, 2], align 2',
+                                               '>')
+        self.assertEqual(matcher.align, 2)
+        self.assertEqual(matcher.find(b'\x00\xff\xff\x00\x00', 0, 5, 5),
+                         (-1, 0))
+        self.assertEqual(matcher.find(b'\x00\xff\xff\xfe\x00\x01', 0, 6, 6),
+                         (2, 2))
+
+        for text in ('uint8 = 256', 'int8 = -129', 'uint16 = -1',
+                     'int64 = 0x8000000000000000', 'float = 1e39',
+                     'double = nan', 'int32 in [5, 1]', 'uint32 = 1 align 3',
+                     'word = 1', 'uint32 = x'):
+            with self.assertRaises(ValueError, msg=text):
+                search.compile_value_pattern(text, '<')
+
+    def test_backward_small_buffer(self):
+        '''backward scans with chunks shorter than the pattern
+        do not report matches that end past pos
+        '''
+
+        data = b'a' * 40
+        filename = self.write_file(data)
+        matcher = search.LiteralMatcher(b'a' * 8)
+        for bufsize in BUFSIZES:
+            scanner = search.Scanner(filename, bufsize)
+            for pos in range(len(data) + 1):
+                self.assertEqual(list(scanner.rfinditer(matcher, pos)),
+                                 brute_literal(data[:pos], b'a' * 8)[::-1])
+
+
+
+class ScannerTest(unittest.TestCase):
+    '''scanning files'''
+
+    def test_shards(self):
+        '''parallel scans give the same matches as a plain scan'''
+
+        data = random_data(5000, b'ab', 9)
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            scanner = search.ParallelScanner(filename, 2, 64, shardsize=700)
+            try:
+                matcher = search.LiteralMatcher(b'abba')
+                self.assertEqual(list(scanner.finditer(matcher, 13, 4800)),
+                                 [(offset, length) for offset, length
+                                  in brute_literal(data, b'abba')
+                                  if 13 <= offset < 4800])
+
+                matcher = search.RegexMatcher(b'a+', 64)
+                self.assertEqual(list(scanner.finditer(matcher, 0,
+                                                       overlapped=False)),
+                                 [(m.start(), m.end() - m.start())
+                                  for m in re.finditer(b'a+', data)])
+            finally:
+                scanner.close()
+        finally:
+            os.unlink(filename)
+
+    def test_shards_not_overlapped(self):
+        '''matches without overlap that run across shard boundaries'''
+
+        data = b'b' * 99 + b'a' * 11 + b'b' * 90 + b'a' * 301 + b'b' * 99
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            scanner = search.ParallelScanner(filename, 2, 16, shardsize=100)
+            try:
+                for pattern in (b'aa', b'aaa', b'a{2,7}'):
+                    matcher = search.RegexMatcher(pattern, 7)
+                    self.assertEqual(list(scanner.finditer(matcher, 0,
+                                                           overlapped=False)),
+                                     [(m.start(), m.end() - m.start())
+                                      for m in re.finditer(pattern, data)])
+            finally:
+                scanner.close()
+        finally:
+            os.unlink(filename)
+
+
+    def test_read_limit(self):
+        '''a scan with an end offset reads only the overlap beyond it'''
+
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(bytes(10000))
+
+            scanner = search.Scanner(filename, 1000)
+            matcher = search.LiteralMatcher(b'abcd')
+            self.assertEqual(list(scanner.finditer(matcher, 0, 1500)), [])
+            self.assertEqual(scanner.scanned, 1503)
+        finally:
+            os.unlink(filename)
+
+
+
+class ResultCacheTest(unittest.TestCase):
+    '''the on-disk result cache'''
+
+    def setUp(self):
+        '''initialize'''
+
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        '''remove the cache file'''
+
+        os.unlink(self.filename)
+
+    def test_roundtrip(self):
+        '''entries come back as they were stored'''
+
+        key = (('/tmp/file', 1, 2, 3, 4), ('text', 'a', 'utf-8', False), 'all')
+        cache = search.ResultCache(self.filename)
+        cache.put(key, array.array('Q', [0, 7, 2 ** 63]))
+        cache.put(key[:2] + ('next', 5), 7)
+        cache.put(key[:2] + ('next', 9), -1)
+        cache.save()
+
+        cache = search.ResultCache(self.filename)
+        cache.load()
+        self.assertEqual(cache.get(key), array.array('Q', [0, 7, 2 ** 63]))
+        self.assertEqual(cache.get(key[:2] + ('next', 5)), 7)
+        self.assertEqual(cache.get(key[:2] + ('next', 9)), -1)
+
+    def test_invalid(self):
+        '''invalid cache files are ignored'''
+
+        for content in (b'\x80\x04\x95junk', b'{"version": 1}',
+                        b'{"version": 1, "entries": [[1, [-1]]]}',
+                        b'{"version": 1, "entries": [[1, "x"]]}',
+                        b'{"version": 99, "entries": []}', b'\xff\xfe'):
+            with open(self.filename, 'wb') as f:
+                f.write(content)
+
+            cache = search.ResultCache(self.filename)
+            cache.load()
+            self.assertEqual(len(cache.entries), 0)
+
+    def test_lru(self):
+        '''the least recently used entry is dropped first'''
+
+        cache = search.ResultCache(maxentries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# EOB